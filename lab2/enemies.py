@@ -5,6 +5,14 @@ import pygame
 from lab2.player import Player
 from maps import map1
 
+# Tiles where ghosts can turn
+INTERSECTIONS = frozenset(
+    (j * 32, i * 32)
+    for i, row in enumerate(map1)
+    for j, item in enumerate(row)
+    if item == 3
+)
+
 
 class Block(pygame.sprite.Sprite):
     def __init__(
@@ -40,10 +48,11 @@ class Ellipse(pygame.sprite.Sprite):
 
 
 class Ghost(pygame.sprite.Sprite):
-    def __init__(self, x, y, change_x, change_y):
+    def __init__(self, x, y, change_x, change_y, method="astar"):
         pygame.sprite.Sprite.__init__(self)
         self.change_x = change_x
         self.change_y = change_y
+        self.method = method
         self.image = pygame.image.load("images/ghost.png").convert_alpha()
         self.rect = self.image.get_rect()
         self.rect.topleft = (x, y)
@@ -195,11 +204,8 @@ class Ghost(pygame.sprite.Sprite):
             self.rect.bottom = 0
 
         if self.rect.topleft in self.get_intersection_position():
-            # direction = self.choose_direction(
-            #     player, "greedy", horizontal_blocks, vertical_blocks
-            # )
             direction = self.choose_direction(
-                player, "astar", horizontal_blocks, vertical_blocks
+                player, self.method, horizontal_blocks, vertical_blocks
             )
             if direction[0] == "l" and self.change_x == 0:
                 self.change_x = -2
@@ -216,10 +222,4 @@ class Ghost(pygame.sprite.Sprite):
 
     @staticmethod
     def get_intersection_position():
-        items = []
-        for i, row in enumerate(map1):
-            for j, item in enumerate(row):
-                if item == 3:
-                    items.append((j * 32, i * 32))
-
-        return items
+        return INTERSECTIONS
@@ -5,7 +5,8 @@ from lab2.player import Player
 
 
 class Game(object):
-    def __init__(self):
+    def __init__(self, ghost_method="astar"):
+        self.ghost_method = ghost_method
         self.font = pygame.font.Font(None, 40)
         self.game_over = True
         self.score = 0
@@ -26,10 +27,10 @@ class Game(object):
                         Block(j * 32 + 8, i * 32 + 8, (0, 0, 0), 16, 16)
                     )
         self.ghosts = pygame.sprite.Group()
-        self.ghosts.add(Ghost(288, 96, 0, 2))
-        self.ghosts.add(Ghost(544, 128, 0, 2))
-        self.ghosts.add(Ghost(160, 64, 2, 0))
-        self.ghosts.add(Ghost(640, 448, 2, 0))
+        self.ghosts.add(Ghost(288, 96, 0, 2, ghost_method))
+        self.ghosts.add(Ghost(544, 128, 0, 2, ghost_method))
+        self.ghosts.add(Ghost(160, 64, 2, 0, ghost_method))
+        self.ghosts.add(Ghost(640, 448, 2, 0, ghost_method))
         for i, row in enumerate(map1):
             for j, item in enumerate(row):
                 if item != 0:
@@ -46,7 +47,7 @@ class Game(object):
                 if event.key == pygame.K_RETURN:
                     if self.game_over:
                         if self.menu.state == 0:
-                            self.__init__()
+                            self.__init__(self.ghost_method)
                             self.game_over = False
                         elif self.menu.state == 1:
                             return True
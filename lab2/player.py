@@ -6,6 +6,8 @@ class Player(pygame.sprite.Sprite):
     change_y = 0
     explosion = False
     game_over = False
+    # Pause in milliseconds after the explosion, before the game is over
+    explosion_wait = 500
 
     def __init__(self, x, y, filename):
         pygame.sprite.Sprite.__init__(self)
@@ -62,7 +64,7 @@ class Player(pygame.sprite.Sprite):
                 self.explosion_animation.index
                 == self.explosion_animation.get_length() - 1
             ):
-                pygame.time.wait(500)
+                pygame.time.wait(self.explosion_wait)
                 self.game_over = True
             self.explosion_animation.update(12)
             self.image = self.explosion_animation.get_current_image()
@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import time
+
+# Has to be set before pygame creates the window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+from lab2.game import Game
+
+# The interactive game runs at 30 frames per second
+REAL_FPS = 30
+
+# Player methods pressing and releasing every arrow key
+KEYS = {
+    "right": ("move_right", "stop_move_right"),
+    "left": ("move_left", "stop_move_left"),
+    "up": ("move_up", "stop_move_up"),
+    "down": ("move_down", "stop_move_down"),
+}
+
+
+def random_agent(seed=0, hold=30):
+    # Holds a random arrow key, a new one every hold ticks
+    rng = random.Random(seed)
+    direction = None
+
+    def agent(game, tick):
+        nonlocal direction
+        if tick % hold == 0:
+            direction = rng.choice(list(KEYS))
+        return direction
+
+    return agent
+
+
+def scripted_agent(script):
+    # (direction, ticks) pairs played in a loop, None releases the keys
+    moves = [direction for direction, ticks in script for _ in range(ticks)]
+
+    def agent(game, tick):
+        return moves[tick % len(moves)]
+
+    return agent
+
+
+def parse_script(text):
+    # "right:40,down:30,none:10"
+    script = []
+    for move in text.split(","):
+        direction, ticks = move.split(":")
+        if direction == "none":
+            direction = None
+        elif direction not in KEYS:
+            raise ValueError(f"Unknown direction: {direction}")
+        script.append((direction, int(ticks)))
+    return script
+
+
+def steer(player, held, direction):
+    # Releases the held key and presses the new one, like a player would
+    if direction != held:
+        if held is not None:
+            getattr(player, KEYS[held][1])()
+        if direction is not None:
+            getattr(player, KEYS[direction][0])()
+    return direction
+
+
+def simulate(agent, ghost_method="astar", max_ticks=10000, screen=None):
+    # One game stepped as fast as possible, a call of run_logic is a tick
+    # of 1 / REAL_FPS seconds. Frames are only drawn when given a screen
+    game = Game(ghost_method)
+    game.game_over = False
+    game.player.explosion_wait = 0
+    held = None
+    ticks = 0
+    while not game.game_over and ticks < max_ticks:
+        held = steer(game.player, held, agent(game, ticks))
+        game.run_logic()
+        if screen is not None:
+            game.display_frame(screen)
+        ticks += 1
+
+    return {
+        "ticks": ticks,
+        "score": game.score,
+        "caught": game.player.explosion,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run lab2 Pacman games without a window, from the lab2 directory"
+    )
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--ticks", type=int, default=10000)
+    parser.add_argument("--ghost-method", choices=("astar", "greedy"), default="astar")
+    parser.add_argument("--agent", choices=("random", "script"), default="random")
+    parser.add_argument("--script", default="right:40,down:30,left:40,up:30")
+    parser.add_argument("--hold", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render", action="store_true")
+    args = parser.parse_args()
+
+    pygame.init()
+    # Sprites convert their images to the display format, so a display is
+    # needed even when nothing is drawn
+    screen = pygame.display.set_mode((800, 576))
+
+    total_ticks = 0
+    started = time.perf_counter()
+    for game_no in range(args.games):
+        if args.agent == "script":
+            agent = scripted_agent(parse_script(args.script))
+        else:
+            agent = random_agent(args.seed + game_no, args.hold)
+        result = simulate(
+            agent,
+            args.ghost_method,
+            args.ticks,
+            screen if args.render else None,
+        )
+        total_ticks += result["ticks"]
+        print(
+            f"game {game_no}: {result['ticks']} ticks, "
+            f"score {result['score']}, "
+            f"{'caught' if result['caught'] else 'not caught'}"
+        )
+    elapsed = time.perf_counter() - started
+    pygame.quit()
+
+    print(
+        f"{total_ticks} ticks in {elapsed:.2f}s: "
+        f"{total_ticks / elapsed:.0f} simulated frames/s, "
+        f"{total_ticks / elapsed / REAL_FPS:.1f}x real time"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from lab3.main import GeneticAlgorithm, GeneticConfig, Group, Problem, Teacher
+
+WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+# Synthetic instance sizes, from the lab example scale up to a faculty
+SCALES = {
+    "small": dict(teachers=50, groups=20, subjects=30, weeks=1),
+    "medium": dict(teachers=200, groups=100, subjects=80, weeks=2),
+    "large": dict(teachers=1000, groups=300, subjects=200, weeks=4),
+    "huge": dict(teachers=2000, groups=500, subjects=400, weeks=8),
+}
+
+
+def synthetic_problem(
+    teachers=50,
+    groups=20,
+    subjects=30,
+    weeks=1,
+    timeslots_per_day=4,
+    subjects_per_teacher=3,
+    subjects_per_group=6,
+    seed=0,
+):
+    rng = random.Random(seed)
+    days = [f"Week {week + 1} {day}" for week in range(weeks) for day in WEEK]
+    subject_names = [f"Subject {i}" for i in range(subjects)]
+    # Roughly twice the load every teacher would get if lessons were spread evenly
+    max_available_time = max(1, 2 * len(days) * timeslots_per_day // teachers)
+
+    return Problem(
+        subject_names,
+        [
+            Teacher(
+                f"Teacher {i}",
+                rng.randint(1, max_available_time),
+                rng.sample(subject_names, min(subjects_per_teacher, subjects)),
+            )
+            for i in range(teachers)
+        ],
+        [
+            Group(
+                f"Group {i}",
+                rng.sample(subject_names, min(subjects_per_group, subjects)),
+            )
+            for i in range(groups)
+        ],
+        days,
+        timeslots_per_day,
+    )
+
+
+def measure_generation_allocations(genetic, generations=10):
+    # Average peak of memory allocated by tracemalloc while one generation
+    # is being built
+    tracemalloc.start()
+    peaks = []
+
+    for _ in range(generations):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        genetic.next_generation()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+
+    tracemalloc.stop()
+    return sum(peaks) / len(peaks)
+
+
+def run_case(problem, config, memory_generations=3):
+    # Timed run first, tracemalloc slows everything down so the peak memory
+    # comes from a separate short run with the same seed
+    started = time.perf_counter()
+    genetic = GeneticAlgorithm(problem, config)
+    setup_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    _, best_fitness_score = genetic.start()
+    elapsed = time.perf_counter() - started
+    generations = genetic.generations_run
+
+    tracemalloc.start()
+    GeneticAlgorithm(problem, config).start(min(memory_generations, generations))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    generation_allocations = measure_generation_allocations(
+        GeneticAlgorithm(problem, config), min(memory_generations, generations)
+    )
+
+    return {
+        "setup_time": setup_time,
+        "elapsed": elapsed,
+        "generations": generations,
+        "generations_per_sec": generations / elapsed,
+        "evaluations_per_sec": genetic.evaluations / elapsed,
+        "full_evaluations": genetic.cache_misses,
+        "peak_memory_bytes": peak_memory,
+        "generation_allocation_bytes": generation_allocations,
+        "best_fitness": best_fitness_score,
+        "stop_reason": genetic.stop_reason,
+        "time_to_target": (
+            elapsed if genetic.stop_reason == "target_fitness" else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lab3 scheduler")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--population", type=int, default=200)
+    parser.add_argument("--generations", type=int, default=50)
+    parser.add_argument("--target-fitness", type=float, default=1.0)
+    parser.add_argument("--fitness-backend", default="python")
+    parser.add_argument("--output", default="benchmark_results.jsonl")
+    args = parser.parse_args()
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        for scale in args.scales:
+            for seed in args.seeds:
+                problem = synthetic_problem(**SCALES[scale], seed=seed)
+                config = GeneticConfig(
+                    population_size=args.population,
+                    generations=args.generations,
+                    fitness_backend=args.fitness_backend,
+                    target_fitness=args.target_fitness,
+                    seed=seed,
+                )
+                result = {
+                    "scale": scale,
+                    **SCALES[scale],
+                    "seed": seed,
+                    "timetable_size": problem.timetable_size,
+                    "config": config.model_dump(),
+                    "python": platform.python_version(),
+                    "timestamp": time.time(),
+                    **run_case(problem, config),
+                }
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                print(
+                    f"{scale} seed={seed}: "
+                    f"{result['generations_per_sec']:.1f} generations/s, "
+                    f"{result['evaluations_per_sec']:.0f} evaluations/s, "
+                    f"peak {result['peak_memory_bytes'] / 2**20:.1f} MiB, "
+                    f"{result['generation_allocation_bytes'] / 2**10:.0f} KiB "
+                    "allocated per generation, "
+                    f"best fitness {result['best_fitness']:.4f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
+import json
+import os
 import random
-from typing import List
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
 
 import pydantic
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the batched fitness backend
+    np = None  # type: ignore[assignment]
+
 
 class BaseModel(pydantic.BaseModel):
     def __repr__(self):
@@ -41,191 +51,803 @@ class Teacher(BaseModel):
         return hash(self.name)
 
 
-class Timeslot(BaseModel):
-    subject_id: int
-    teacher_id: int
-    group_id: int
+class Timeslot:
+    # View of a single gene of a Chromosome
+    __slots__ = ("genes", "offset")
 
-    def __init__(self, subject_id: int, teacher_id: int, group_id: int) -> None:
-        super().__init__(
-            subject_id=subject_id, teacher_id=teacher_id, group_id=group_id
+    def __init__(self, genes: array, index: int) -> None:
+        self.genes = genes
+        self.offset = index * 3
+
+    @property
+    def subject_id(self) -> int:
+        return self.genes[self.offset]
+
+    @property
+    def teacher_id(self) -> int:
+        return self.genes[self.offset + 1]
+
+    @property
+    def group_id(self) -> int:
+        return self.genes[self.offset + 2]
+
+    def __repr__(self):
+        return (
+            f"Timeslot(subject_id={self.subject_id}, teacher_id={self.teacher_id}, "
+            f"group_id={self.group_id})"
         )
 
-    def __hash__(self):
-        return hash((self.subject_id, self.teacher_id, self.group_id))
 
+class Chromosome:
+    # Flat (subject_id, teacher_id, group_id) triples, one per timeslot
+    __slots__ = ("genes",)
 
-class Schedule:
+    def __init__(self, genes: array) -> None:
+        self.genes = genes
+
+    @classmethod
+    def empty(cls, size: int) -> "Chromosome":
+        return cls(array("H", bytes(size * 3 * array("H").itemsize)))
+
+    def __len__(self) -> int:
+        return len(self.genes) // 3
+
+    def __getitem__(self, index: int) -> Timeslot:
+        if not 0 <= index < len(self):
+            raise IndexError("timeslot index out of range")
+        return Timeslot(self.genes, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Timeslot(self.genes, index)
+
+    def copy(self) -> "Chromosome":
+        return Chromosome(array("H", self.genes))
+
+    def splice(self, other, start: int, end: int) -> None:
+        # Copies the [start, end) timeslots of other into this chromosome's buffer
+        memoryview(self.genes)[start * 3 : end * 3] = memoryview(other.genes)[
+            start * 3 : end * 3
+        ]
+
+
+class Eligibility:
+    # Integer indexes of which teachers and groups fit each subject, built
+    # once per problem instead of comparing subject names on every check
+    def __init__(self, subjects, teachers, groups):
+        self.teacher_knows_subject = [
+            bytes(subject in teacher.knowledgeable_subjects for subject in subjects)
+            for teacher in teachers
+        ]
+        self.group_needs_subject = [
+            bytes(subject in group.required_subjects for subject in subjects)
+            for group in groups
+        ]
+        self.subject_teachers = [
+            tuple(
+                teacher_id
+                for teacher_id, knows in enumerate(self.teacher_knows_subject)
+                if knows[subject_id]
+            )
+            for subject_id in range(len(subjects))
+        ]
+        self.subject_groups = [
+            tuple(
+                group_id
+                for group_id, needs in enumerate(self.group_needs_subject)
+                if needs[subject_id]
+            )
+            for subject_id in range(len(subjects))
+        ]
+        self.available_time = [teacher.available_time for teacher in teachers]
+
+
+class Problem:
+    # Everything a schedule is built from, shared by all schedules of a run
     def __init__(self, subjects, teachers, groups, days, timeslots_per_day):
         self.subjects = subjects
         self.teachers = teachers
         self.groups = groups
         self.days = days
         self.timeslots_per_day = timeslots_per_day
-        self.timetable = self.generate_random_schedule()
-
-    def generate_random_schedule(self):
-        timetable_size = len(self.days) * self.timeslots_per_day
-        timetable = []
-
-        for _ in range(timetable_size):
-            timetable.append(
-                Timeslot(
-                    random.randint(0, len(self.subjects) - 1),
-                    random.randint(0, len(self.teachers) - 1),
-                    random.randint(0, len(self.groups) - 1),
-                )
-            )
+        self.timetable_size = len(days) * timeslots_per_day
+        self.eligibility = Eligibility(subjects, teachers, groups)
+
+
+class Conflicts:
+    # Conflict counters of a schedule, kept in sync with its timetable so the
+    # fitness can be updated for the changed genes only
+    __slots__ = (
+        "teacher_loads",
+        "overloaded_teachers",
+        "slot_conflicts",
+        "subject_conflicts",
+    )
+
+    def __init__(
+        self, teacher_loads, overloaded_teachers, slot_conflicts, subject_conflicts
+    ):
+        self.teacher_loads = teacher_loads
+        self.overloaded_teachers = overloaded_teachers
+        self.slot_conflicts = slot_conflicts
+        self.subject_conflicts = subject_conflicts
+
+    def copy(self) -> "Conflicts":
+        return Conflicts(
+            array("l", self.teacher_loads),
+            self.overloaded_teachers,
+            array("B", self.slot_conflicts),
+            self.subject_conflicts,
+        )
+
+    def fitness_score(self) -> float:
+        return 1.0 / (self.overloaded_teachers + self.subject_conflicts + 1.0)
+
+
+class Schedule:
+    def __init__(self, problem, timetable=None, rng=random):
+        self.problem = problem
+        self.eligibility = problem.eligibility
+        if timetable is None:
+            timetable = self.generate_random_schedule(rng)
+        self.timetable = timetable
+        # Memoized check_correctness() result, updated through the conflict
+        # counters when the timetable changes or reset if there are none
+        self.fitness_score = None
+        self.conflicts = None
+
+    def generate_random_schedule(self, rng=random):
+        problem = self.problem
+        timetable = Chromosome.empty(problem.timetable_size)
+        genes = timetable.genes
+
+        for i in range(0, problem.timetable_size * 3, 3):
+            genes[i] = rng.randint(0, len(problem.subjects) - 1)
+            genes[i + 1] = rng.randint(0, len(problem.teachers) - 1)
+            genes[i + 2] = rng.randint(0, len(problem.groups) - 1)
 
         return timetable
 
+    def encode(self):
+        # Compact integer form used to pass schedules between processes
+        return array("H", self.timetable.genes)
+
+    @classmethod
+    def decode(cls, codes, problem):
+        return cls(problem, timetable=Chromosome(array("H", codes)))
+
+    def clone(self):
+        # Shares the problem definition, only the timetable is copied
+        schedule = Schedule(self.problem, timetable=self.timetable.copy())
+        if self.conflicts is not None:
+            schedule.conflicts = self.conflicts.copy()
+            schedule.fitness_score = self.fitness_score
+        return schedule
+
+    def subject_conflicts(self, subject_id, teacher_id, group_id):
+        eligibility = self.eligibility
+        return (
+            2
+            - eligibility.teacher_knows_subject[teacher_id][subject_id]
+            - eligibility.group_needs_subject[group_id][subject_id]
+        )
+
     def check_correctness(self):
-        conflicts = 0
+        genes = self.timetable.genes
+        subject_ids = genes[0::3]
+        teacher_ids = genes[1::3]
+        group_ids = genes[2::3]
+
         # Teacher's available time conflict
-        for i in range(len(self.teachers)):
-            if (
-                len([t for t in self.timetable if t.teacher_id == i])
-                > self.teachers[i].available_time
-            ):
-                conflicts += 1
+        teacher_loads = array("l", [0]) * len(self.problem.teachers)
+        for teacher_id in teacher_ids:
+            teacher_loads[teacher_id] += 1
+        overloaded_teachers = sum(
+            load > available_time
+            for load, available_time in zip(
+                teacher_loads, self.eligibility.available_time
+            )
+        )
 
         # Subject conflict
-        for timeslot in self.timetable:
-            # Teachers
-            if (
-                self.subjects[timeslot.subject_id]
-                not in self.teachers[timeslot.teacher_id].knowledgeable_subjects
-            ):
-                conflicts += 1
+        slot_conflicts = array(
+            "B",
+            map(self.subject_conflicts, subject_ids, teacher_ids, group_ids),
+        )
+
+        self.conflicts = Conflicts(
+            teacher_loads, overloaded_teachers, slot_conflicts, sum(slot_conflicts)
+        )
+        return self.conflicts.fitness_score()
+
+    def move_teacher_load(self, old_teacher_id, new_teacher_id):
+        conflicts = self.conflicts
+        loads = conflicts.teacher_loads
+        available_time = self.eligibility.available_time
+
+        loads[old_teacher_id] -= 1
+        if loads[old_teacher_id] == available_time[old_teacher_id]:
+            conflicts.overloaded_teachers -= 1
+
+        loads[new_teacher_id] += 1
+        if loads[new_teacher_id] == available_time[new_teacher_id] + 1:
+            conflicts.overloaded_teachers += 1
+
+    def set_gene(self, index, field, value):
+        # field is 0 for the subject, 1 for the teacher and 2 for the group.
+        # Returns whether the fitness was updated from the conflict counters
+        genes = self.timetable.genes
+        offset = index * 3
+        if genes[offset + field] == value:
+            return False
+
+        conflicts = self.conflicts
+        if conflicts is None:
+            genes[offset + field] = value
+            self.fitness_score = None
+            return False
+
+        if field == 1:
+            self.move_teacher_load(genes[offset + 1], value)
+        genes[offset + field] = value
+
+        slot_conflicts = self.subject_conflicts(
+            genes[offset], genes[offset + 1], genes[offset + 2]
+        )
+        conflicts.subject_conflicts += slot_conflicts - conflicts.slot_conflicts[index]
+        conflicts.slot_conflicts[index] = slot_conflicts
+        self.fitness_score = conflicts.fitness_score()
+        return True
+
+    def splice(self, other, start, end):
+        # Takes the [start, end) timeslots from other, the conflict counters
+        # are updated for the copied timeslots only. Returns whether the
+        # fitness was updated from them
+        conflicts = self.conflicts
+        if conflicts is None or other.conflicts is None:
+            self.timetable.splice(other.timetable, start, end)
+            self.conflicts = None
+            self.fitness_score = None
+            return False
+
+        teacher_ids = self.timetable.genes[start * 3 + 1 : end * 3 : 3]
+        other_teacher_ids = other.timetable.genes[start * 3 + 1 : end * 3 : 3]
+        loads = conflicts.teacher_loads
+        available_time = self.eligibility.available_time
+        overloaded_teachers = conflicts.overloaded_teachers
+        for old_teacher_id, new_teacher_id in zip(teacher_ids, other_teacher_ids):
+            if old_teacher_id != new_teacher_id:
+                loads[old_teacher_id] -= 1
+                if loads[old_teacher_id] == available_time[old_teacher_id]:
+                    overloaded_teachers -= 1
+                loads[new_teacher_id] += 1
+                if loads[new_teacher_id] == available_time[new_teacher_id] + 1:
+                    overloaded_teachers += 1
+        conflicts.overloaded_teachers = overloaded_teachers
+
+        slot_conflicts = conflicts.slot_conflicts
+        other_slot_conflicts = other.conflicts.slot_conflicts[start:end]
+        conflicts.subject_conflicts += sum(other_slot_conflicts) - sum(
+            slot_conflicts[start:end]
+        )
+        slot_conflicts[start:end] = other_slot_conflicts
+
+        self.timetable.splice(other.timetable, start, end)
+        self.fitness_score = conflicts.fitness_score()
+        return True
+
+
+class BatchFitness:
+    # Scores the whole population at once, the result is identical to
+    # calling Schedule.check_correctness on every schedule
+    def __init__(self, eligibility):
+        if np is None:
+            raise RuntimeError(
+                "numpy is required for the batched fitness backend, "
+                "install it with `poetry install --extras numpy`"
+            )
+
+        self.teacher_knows_subject = np.array(
+            [list(knows) for knows in eligibility.teacher_knows_subject], dtype=bool
+        )
+        self.group_needs_subject = np.array(
+            [list(needs) for needs in eligibility.group_needs_subject], dtype=bool
+        )
+        self.available_time = np.array(eligibility.available_time, dtype=np.int64)
+
+    def encode(self, population):
+        # (population x slots x 3) array of subject, teacher and group ids
+        return np.stack(
+            [
+                np.frombuffer(schedule.timetable.genes, dtype=np.uint16)
+                for schedule in population
+            ]
+        ).reshape(len(population), -1, 3)
+
+    def conflicts(self, timetables):
+        population_size = timetables.shape[0]
+        teachers_count = len(self.available_time)
+        subject_ids = timetables[:, :, 0]
+        teacher_ids = timetables[:, :, 1]
+        group_ids = timetables[:, :, 2]
+
+        # Subject conflict
+        slot_conflicts = (~self.teacher_knows_subject[teacher_ids, subject_ids]).view(
+            np.uint8
+        ) + (~self.group_needs_subject[group_ids, subject_ids]).view(np.uint8)
+
+        # Teacher's available time conflict, every schedule gets its own
+        # range of bins so a single bincount covers the whole population
+        offsets = np.arange(population_size)[:, None] * teachers_count
+        loads = np.bincount(
+            (teacher_ids + offsets).ravel(),
+            minlength=population_size * teachers_count,
+        ).reshape(population_size, teachers_count)
+        overloaded_teachers = np.count_nonzero(loads > self.available_time, axis=1)
+
+        return loads, overloaded_teachers, slot_conflicts
+
+    def __call__(self, population):
+        # Scores the schedules and attaches their conflict counters
+        loads, overloaded_teachers, slot_conflicts = self.conflicts(
+            self.encode(population)
+        )
+        for i, schedule in enumerate(population):
+            schedule.conflicts = Conflicts(
+                array("l", loads[i].tolist()),
+                int(overloaded_teachers[i]),
+                array("B", slot_conflicts[i].tobytes()),
+                int(slot_conflicts[i].sum()),
+            )
+            schedule.fitness_score = schedule.conflicts.fitness_score()
+
+
+class GeneticConfig(BaseModel):
+    population_size: int = 20
+    generations: int = 100
+    mutation_rate: float = 0.1
+    tournament_size: int = 3
+    fitness_backend: str = "python"
+    # Stopping criteria, None disables a criterion
+    target_fitness: Optional[float] = None
+    stagnation_window: Optional[int] = None
+    time_budget: Optional[float] = None
+    # Seed of the algorithm's own random generator, None seeds it from the OS
+    seed: Optional[int] = None
 
-            # Groups
-            if (
-                self.subjects[timeslot.subject_id]
-                not in self.groups[timeslot.group_id].required_subjects
-            ):
-                conflicts += 1
 
-        return 1.0 / (conflicts + 1.0)
+TIMINGS = ("fitness", "selection", "crossover", "mutation")
 
 
 class GeneticAlgorithm:
-    def __init__(self, population_size):
-        self.population = self.generate_population(population_size)
+    def __init__(self, problem, config=None, population=None):
+        if config is None:
+            config = GeneticConfig()
+        self.problem = problem
+        self.config = config
+        self.population_size = config.population_size
+        self.random = random.Random(config.seed)
+        if population is None:
+            population = self.generate_population(self.population_size)
+        self.population = population
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Full scores plus the incremental ones done by splice and set_gene
+        self.evaluations = 0
+        self.timings = dict.fromkeys(TIMINGS, 0.0)
+        self.stop_reason = None
+        self.generations_run = 0
+        if config.fitness_backend == "numpy":
+            self.batch_fitness = BatchFitness(problem.eligibility)
+        elif config.fitness_backend == "python":
+            self.batch_fitness = None
+        else:
+            raise ValueError(f"Unknown fitness backend: {config.fitness_backend}")
 
     def generate_population(self, population_size):
-        return [
-            Schedule(SUBJECTS, teachers, GROUPS, DAYS, TIMESLOTS_PER_DAY)
-            for _ in range(population_size)
-        ]
+        return [Schedule(self.problem, rng=self.random) for _ in range(population_size)]
 
     def create_offspring(self, schedule1, schedule2):
-        crossover_point1 = random.randint(1, len(schedule1.timetable) - 2)
-        crossover_point2 = random.randint(1, len(schedule1.timetable) - 2)
+        crossover_point1 = self.random.randint(1, len(schedule1.timetable) - 2)
+        crossover_point2 = self.random.randint(1, len(schedule1.timetable) - 2)
         start = min(crossover_point1, crossover_point2)
         end = max(crossover_point1, crossover_point2)
-        child1 = Schedule(
-            schedule1.subjects,
-            schedule1.teachers,
-            schedule1.groups,
-            schedule1.days,
-            schedule1.timeslots_per_day,
-        )
-        child2 = Schedule(
-            schedule2.subjects,
-            schedule2.teachers,
-            schedule2.groups,
-            schedule2.days,
-            schedule2.timeslots_per_day,
-        )
-        child1.timetable = (
-            schedule1.timetable[:start]
-            + schedule2.timetable[start:end]
-            + schedule1.timetable[end:]
-        )
-
-        child2.timetable = (
-            schedule2.timetable[:start]
-            + schedule1.timetable[start:end]
-            + schedule2.timetable[end:]
+        child1 = schedule1.clone()
+        child2 = schedule2.clone()
+        started = time.perf_counter()
+        rescored = child1.splice(schedule2, start, end) + child2.splice(
+            schedule1, start, end
         )
+        if rescored:
+            self.count_incremental_evaluations(rescored, started)
 
         return child1, child2
 
+    def count_incremental_evaluations(self, count, started):
+        # The splice or set_gene call since started rescored count schedules
+        self.evaluations += count
+        self.timings["fitness"] += time.perf_counter() - started
+
+    def fitness(self, schedule):
+        if schedule.fitness_score is None:
+            self.cache_misses += 1
+            self.evaluations += 1
+            schedule.fitness_score = schedule.check_correctness()
+        else:
+            self.cache_hits += 1
+        return schedule.fitness_score
+
+    def evaluate_population(self):
+        if self.batch_fitness is not None:
+            unscored = [s for s in self.population if s.fitness_score is None]
+            if unscored:
+                self.batch_fitness(unscored)
+            self.cache_misses += len(unscored)
+            self.cache_hits += len(self.population) - len(unscored)
+            self.evaluations += len(unscored)
+            return [schedule.fitness_score for schedule in self.population]
+        return [self.fitness(schedule) for schedule in self.population]
+
     def select_best(self, fitness_scores):
         best_index = fitness_scores.index(max(fitness_scores))
         return self.population[best_index], fitness_scores[best_index]
 
     def mutate(self, schedule):
-        import random
+        rng = self.random
+        problem = schedule.problem
 
-        if random.random() < MUTATION_RATE:
-            timeslot_id = random.randint(
-                0, len(schedule.days) * schedule.timeslots_per_day - 1
-            )
-            timeslot = schedule.timetable[timeslot_id]
+        if rng.random() < self.config.mutation_rate:
+            timeslot_id = rng.randint(0, problem.timetable_size - 1)
+            subject_id = schedule.timetable[timeslot_id].subject_id
 
-            timeslot_property = random.randint(0, 2)
+            timeslot_property = rng.randint(0, 2)
 
+            # Teachers and groups are drawn only from the ones that fit the
+            # subject, unless there are none
             if timeslot_property == 0:
-                timeslot.subject_id = random.randint(0, len(schedule.subjects) - 1)
+                value = rng.randint(0, len(problem.subjects) - 1)
             elif timeslot_property == 1:
-                for _ in range(20):
-                    timeslot.teacher_id = random.randint(0, len(schedule.teachers) - 1)
-
-                    if (
-                        schedule.subjects[timeslot.subject_id]
-                        in schedule.teachers[timeslot.teacher_id].knowledgeable_subjects
-                    ):
-                        break
+                eligible = schedule.eligibility.subject_teachers[subject_id]
+                if eligible:
+                    value = rng.choice(eligible)
+                else:
+                    value = rng.randint(0, len(problem.teachers) - 1)
             else:
-                for _ in range(20):
-                    timeslot.group_id = random.randint(0, len(schedule.groups) - 1)
+                eligible = schedule.eligibility.subject_groups[subject_id]
+                if eligible:
+                    value = rng.choice(eligible)
+                else:
+                    value = rng.randint(0, len(problem.groups) - 1)
 
-                    if (
-                        schedule.subjects[timeslot.subject_id]
-                        in schedule.groups[timeslot.group_id].required_subjects
-                    ):
-                        break
+            started = time.perf_counter()
+            if schedule.set_gene(timeslot_id, timeslot_property, value):
+                self.count_incremental_evaluations(1, started)
 
         return schedule
 
     def tournament_selection(self, k: int) -> Schedule:
-        contenders = random.sample(self.population, k)
-        fitness_scores = [schedule.check_correctness() for schedule in contenders]
+        contenders = self.random.sample(self.population, k)
+        fitness_scores = [self.fitness(schedule) for schedule in contenders]
         winner_index = fitness_scores.index(max(fitness_scores))
         return contenders[winner_index]
 
-    def start(self) -> (Schedule, float):
+    def diversity(self):
+        # Share of distinct timetables in the population
+        distinct = {schedule.timetable.genes.tobytes() for schedule in self.population}
+        return len(distinct) / len(self.population)
+
+    def start(self, generations=None, on_generation=None) -> (Schedule, float):
+        # Stops after `generations` (config.generations by default), as soon
+        # as the best schedule reaches config.target_fitness, after
+        # config.stagnation_window generations without an improvement or once
+        # config.time_budget seconds have passed
+        if generations is None:
+            generations = self.config.generations
+        target_fitness = self.config.target_fitness
+        stagnation_window = self.config.stagnation_window
+        time_budget = self.config.time_budget
         best_schedule = None
         best_fitness_score = 0
-
-        for generation in range(GENERATIONS):
-            fitness_scores = [
-                schedule.check_correctness() for schedule in self.population
-            ]
-
+        stagnant_generations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.evaluations = 0
+        self.stop_reason = "generations"
+        self.generations_run = 0
+        started = time.perf_counter()
+
+        for generation in range(generations):
+            generation_started = time.perf_counter()
+            evaluations = self.evaluations
+            self.timings = dict.fromkeys(TIMINGS, 0.0)
+
+            fitness_scores = self.evaluate_population()
+            self.timings["fitness"] += time.perf_counter() - generation_started
             schedule, fitness_score = self.select_best(fitness_scores)
-            best_schedule = schedule
-            best_fitness_score = fitness_score
 
-            new_population = []
+            if fitness_score > best_fitness_score:
+                best_schedule = schedule
+                best_fitness_score = fitness_score
+                stagnant_generations = 0
+            else:
+                stagnant_generations += 1
+
+            if on_generation is not None:
+                mean_fitness_score = sum(fitness_scores) / len(fitness_scores)
+                diversity = self.diversity()
+
+            # Checked before breeding, so a stopped run doesn't breed a
+            # generation for nothing and its population still holds the best
+            if target_fitness is not None and best_fitness_score >= target_fitness:
+                self.stop_reason = "target_fitness"
+            elif stagnation_window is not None and (
+                stagnant_generations >= stagnation_window
+            ):
+                self.stop_reason = "stagnation"
+            elif time_budget is not None and (
+                time.perf_counter() - started >= time_budget
+            ):
+                self.stop_reason = "time_budget"
+            stopped = self.stop_reason != "generations"
+
+            if not stopped:
+                self.breed()
+            self.generations_run += 1
+
+            if on_generation is not None:
+                elapsed = time.perf_counter() - generation_started
+                evaluations = self.evaluations - evaluations
+                on_generation(
+                    {
+                        "generation": generation,
+                        "best_fitness": fitness_score,
+                        "best_fitness_so_far": best_fitness_score,
+                        "mean_fitness": mean_fitness_score,
+                        "diversity": diversity,
+                        **{f"{name}_time": t for name, t in self.timings.items()},
+                        "generation_time": elapsed,
+                        "evaluations": evaluations,
+                        "evaluations_per_sec": evaluations / elapsed,
+                    }
+                )
 
-            while len(new_population) < POPULATION_SIZE:
-                parent1 = self.tournament_selection(3)  # Турнір між 3 кандидатами
-                parent2 = self.tournament_selection(3)  # Турнір між 3 кандидатами
-                child1, child2 = self.create_offspring(parent1, parent2)
-                new_population.extend([self.mutate(child1), self.mutate(child2)])
+            if stopped:
+                break
 
-            self.population = new_population
+        return best_schedule, best_fitness_score
 
+    def next_generation(self) -> Tuple[Schedule, float]:
+        fitness_scores = self.evaluate_population()
+        schedule, fitness_score = self.select_best(fitness_scores)
+        self.breed()
+        return schedule, fitness_score
+
+    def breed(self):
+        timings = self.timings
+        new_population = []
+
+        while len(new_population) < self.population_size:
+            started = time.perf_counter()
+            # Турнір між tournament_size (3) кандидатами
+            parent1 = self.tournament_selection(self.config.tournament_size)
+            parent2 = self.tournament_selection(self.config.tournament_size)
+            selected = time.perf_counter()
+            # Incremental rescoring is timed as fitness, not crossover or mutation
+            fitness_time = timings["fitness"]
+            child1, child2 = self.create_offspring(parent1, parent2)
+            crossed = time.perf_counter()
+            crossover_fitness_time = timings["fitness"] - fitness_time
+            new_population.extend([self.mutate(child1), self.mutate(child2)])
+            mutation_fitness_time = (
+                timings["fitness"] - fitness_time - crossover_fitness_time
+            )
+            timings["selection"] += selected - started
+            timings["crossover"] += crossed - selected - crossover_fitness_time
+            timings["mutation"] += time.perf_counter() - crossed - mutation_fitness_time
+
+        self.population = new_population
+
+
+class JsonlStatsWriter:
+    # on_generation callback that appends every generation's stats to a file
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, stats):
+        self.file.write(json.dumps(stats) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def evolve_island(problem, config, codes, generations, seed, time_budget=None):
+    # Stagnation is tracked across epochs by IslandModel, and time_budget is
+    # what is left of the whole run's budget
+    population = None
+    if codes is not None:
+        population = [Schedule.decode(c, problem) for c in codes]
+    config = config.model_copy(
+        update={"seed": seed, "stagnation_window": None, "time_budget": time_budget}
+    )
+    genetic = GeneticAlgorithm(problem, config, population)
+    stats = []
+    best_schedule, best_fitness_score = genetic.start(generations, stats.append)
+    fitness_scores = genetic.evaluate_population()
+    # The best schedule of the run may have been bred away, so it is sent
+    # back on its own
+    best_index = fitness_scores.index(max(fitness_scores))
+    if best_schedule is None or fitness_scores[best_index] > best_fitness_score:
+        best_schedule = genetic.population[best_index]
+        best_fitness_score = fitness_scores[best_index]
+    return (
+        [schedule.encode() for schedule in genetic.population],
+        fitness_scores,
+        best_schedule.encode(),
+        best_fitness_score,
+        genetic.cache_hits,
+        genetic.cache_misses,
+        stats,
+    )
+
+
+class IslandModel:
+    # Independent populations evolved in a process pool, every
+    # migration_interval generations the best schedules of each island
+    # replace the worst ones of the next island in the ring
+    def __init__(
+        self,
+        problem,
+        config=None,
+        islands=None,
+        migration_interval=10,
+        migrants=1,
+        processes=None,
+    ):
+        if config is None:
+            config = GeneticConfig()
+        self.problem = problem
+        self.config = config
+        self.islands = islands or os.cpu_count() or 1
+        self.migration_interval = migration_interval
+        self.migrants = migrants
+        self.processes = processes
+        self.random = random.Random(config.seed)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stop_reason = None
+        self.generations_run = 0
+
+    def migrate(self, populations, fitness_scores):
+        ranked = [
+            sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+            for scores in fitness_scores
+        ]
+        emigrants = [
+            [
+                (populations[i][j], fitness_scores[i][j])
+                for j in ranking[: self.migrants]
+            ]
+            for i, ranking in enumerate(ranked)
+        ]
+        for i in range(self.islands):
+            target = (i + 1) % self.islands
+            worst = ranked[target][::-1][: self.migrants]
+            for j, (codes, fitness_score) in zip(worst, emigrants[i]):
+                populations[target][j] = codes
+                fitness_scores[target][j] = fitness_score
+
+    def start(self, generations=None, on_generation=None) -> Tuple[Schedule, float]:
+        # Same stopping criteria as GeneticAlgorithm.start, applied to the
+        # whole run: the time budget is shared by all epochs, and stagnation
+        # is counted in generations of epochs that didn't improve the best
+        # schedule of any island. on_generation gets every island's
+        # per-generation stats once its epoch is over
+        if generations is None:
+            generations = self.config.generations
+        target_fitness = self.config.target_fitness
+        stagnation_window = self.config.stagnation_window
+        time_budget = self.config.time_budget
+        best_codes = None
+        best_fitness_score = 0
+        stagnant_generations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stop_reason = "generations"
+        self.generations_run = 0
+        populations = [None] * self.islands
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            done = 0
+            while done < generations:
+                epoch = min(self.migration_interval, generations - done)
+                remaining = None
+                if time_budget is not None:
+                    remaining = time_budget - (time.perf_counter() - started)
+                futures = [
+                    executor.submit(
+                        evolve_island,
+                        self.problem,
+                        self.config,
+                        codes,
+                        epoch,
+                        self.random.getrandbits(32),
+                        remaining,
+                    )
+                    for codes in populations
+                ]
+                results = [future.result() for future in futures]
+
+                populations = [result[0] for result in results]
+                fitness_scores = [result[1] for result in results]
+                improved = False
+                for island, result in enumerate(results):
+                    _, _, codes, fitness_score, hits, misses, stats = result
+                    self.cache_hits += hits
+                    self.cache_misses += misses
+                    if fitness_score > best_fitness_score:
+                        best_codes = codes
+                        best_fitness_score = fitness_score
+                        improved = True
+                    if on_generation is None:
+                        continue
+                    for generation_stats in stats:
+                        generation = done + generation_stats["generation"]
+                        on_generation(
+                            {
+                                **generation_stats,
+                                "generation": generation,
+                                "island": island,
+                            }
+                        )
+                # Islands stop early only on target_fitness or time_budget,
+                # which end the whole run below
+                epoch_generations = max(len(result[6]) for result in results)
+                done += epoch_generations
+                self.generations_run = done
+                if improved:
+                    stagnant_generations = 0
+                else:
+                    stagnant_generations += epoch_generations
+
+                if target_fitness is not None and best_fitness_score >= target_fitness:
+                    self.stop_reason = "target_fitness"
+                elif stagnation_window is not None and (
+                    stagnant_generations >= stagnation_window
+                ):
+                    self.stop_reason = "stagnation"
+                elif time_budget is not None and (
+                    time.perf_counter() - started >= time_budget
+                ):
+                    self.stop_reason = "time_budget"
+                if self.stop_reason != "generations":
+                    break
+                if done < generations and self.islands > 1:
+                    self.migrate(populations, fitness_scores)
+
+        best_schedule = Schedule.decode(best_codes, self.problem)
         return best_schedule, best_fitness_score
 
 
 # Constants
 TIMESLOTS_PER_DAY = 3
-POPULATION_SIZE = 20
-MUTATION_RATE = 0.1
-GENERATIONS = 100
+TARGET_FITNESS = 1.0
+STATS_FILE = None
+# "python" or "numpy" (batched scoring, needs the numpy extra). Children
+# inherit their parent's conflict counters and are rescored incrementally, so
+# the batched backend only scores the initial population (and the population
+# each island gets back after a migration) and doesn't speed up later
+# generations
+FITNESS_BACKEND = "python"
+ISLANDS = os.cpu_count() or 1
+MIGRATION_INTERVAL = 10
 
 DAYS = ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця"]
 SUBJECTS = [
@@ -249,18 +871,39 @@ GROUPS = [
 ]
 
 
-# Running the genetic algorithm
-genetic = GeneticAlgorithm(POPULATION_SIZE)
-best_schedule, best_fitness_score = genetic.start()
-best_schedule.timetable.reverse()
+def print_schedule(schedule, fitness_score):
+    problem = schedule.problem
+    timetable = iter(schedule.timetable)
 
-for day in DAYS:
-    for slot in range(TIMESLOTS_PER_DAY):
-        timeslot = best_schedule.timetable.pop()
+    for day in problem.days:
+        for slot in range(problem.timeslots_per_day):
+            timeslot = next(timetable)
 
-        print(
-            f"{day}, {slot+1} пара: {SUBJECTS[timeslot.subject_id]} від "
-            f"{teachers[timeslot.teacher_id].name} для {GROUPS[timeslot.group_id].name}"
-        )
+            print(
+                f"{day}, {slot+1} пара: {problem.subjects[timeslot.subject_id]} від "
+                f"{problem.teachers[timeslot.teacher_id].name} "
+                f"для {problem.groups[timeslot.group_id].name}"
+            )
 
-print(f"Fitness score: {best_fitness_score}")
+    print(f"Fitness score: {fitness_score}")
+
+
+if __name__ == "__main__":
+    # Running the genetic algorithm
+    problem = Problem(SUBJECTS, teachers, GROUPS, DAYS, TIMESLOTS_PER_DAY)
+    config = GeneticConfig(
+        fitness_backend=FITNESS_BACKEND, target_fitness=TARGET_FITNESS
+    )
+    genetic: Union[IslandModel, GeneticAlgorithm]
+    if ISLANDS > 1:
+        genetic = IslandModel(problem, config, ISLANDS, MIGRATION_INTERVAL)
+    else:
+        genetic = GeneticAlgorithm(problem, config)
+    stats_writer = JsonlStatsWriter(STATS_FILE) if STATS_FILE else None
+    best_schedule, best_fitness_score = genetic.start(on_generation=stats_writer)
+    if stats_writer is not None:
+        stats_writer.close()
+    print(f"Stopped by: {genetic.stop_reason}")
+
+    print_schedule(best_schedule, best_fitness_score)
+    print(f"Fitness cache: {genetic.cache_hits} hits, {genetic.cache_misses} misses")
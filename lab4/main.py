@@ -1,6 +1,14 @@
 import copy
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
 import random
-from typing import Dict, List, Optional, Set, Tuple
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 import pydantic
 
@@ -32,7 +40,7 @@ class GroupSubject(pydantic.BaseModel):
         super().__init__(**kwargs)
 
     def __hash__(self):
-        return hash(self.name)
+        return hash((self.subject, self.hours))
 
 
 class Group(pydantic.BaseModel):
@@ -57,6 +65,8 @@ class Group(pydantic.BaseModel):
 class Teacher(pydantic.BaseModel):
     name: str
     subjects: List[Subject]  # refs to existing subjects
+    # (day, timeslot) pairs the teacher can't teach at
+    unavailable: List[Tuple[str, int]] = []
 
     def __init__(self, name: str, **kwargs) -> None:
         kwargs["name"] = name
@@ -145,21 +155,56 @@ for group in GROUPS:
         TOTAL_SLOTS_TO_BE_FILLED += subject.hours
 
 
-class Variable(pydantic.BaseModel):
-    group: Group
-    subject: Subject
-    subject_no: int
+class Variable:
+    # One lesson of a group's subject. Solver-side record: compile_problem
+    # numbers the variables, groups and subjects, and the hash is computed
+    # once, so the many dict and set lookups during search are cheap
+    __slots__ = (
+        "group",
+        "subject",
+        "subject_no",
+        "id",
+        "group_id",
+        "subject_id",
+        "key",
+        "_hash",
+    )
 
     def __init__(
-        self, group: Group, subject: Subject, subject_no: int, **kwargs
+        self,
+        group: Group,
+        subject: Subject,
+        subject_no: int,
+        var_id: int = -1,
+        group_id: int = -1,
+        subject_id: int = -1,
     ) -> None:
-        kwargs["group"] = group
-        kwargs["subject"] = subject
-        kwargs["subject_no"] = subject_no
-        super().__init__(**kwargs)
+        self.group = group
+        self.subject = subject
+        self.subject_no = subject_no
+        self.id = var_id
+        self.group_id = group_id
+        self.subject_id = subject_id
+        self.key = (group.name, subject.name, subject_no)
+        self._hash = hash(self.key)
 
     def __hash__(self):
-        return hash((self.group, self.subject, self.subject_no))
+        return self._hash
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, Variable) and self.key == other.key)
+
+    def __reduce__(self):
+        # String hashes differ between processes, rebuild instead of copying
+        # the cached hash
+        return Variable, (
+            self.group,
+            self.subject,
+            self.subject_no,
+            self.id,
+            self.group_id,
+            self.subject_id,
+        )
 
     def __repr__(self):
         return f"Variable({self.group}, {self.subject}, {self.subject_no})"
@@ -171,123 +216,562 @@ class Variable(pydantic.BaseModel):
 Assignment = Dict[Variable, Tuple[str, int, Teacher]]
 
 
-# Variables
-variables: List[Variable] = [
-    Variable(group, gs.subject, subject_no)
-    for group in GROUPS
-    for gs in group.subjects
-    for subject_no in range(gs.hours)
-]
+def build_neighbours(
+    variables_: List[Variable],
+    domains_: Dict[Variable, List[Tuple[str, int, Teacher]]],
+) -> Dict[Variable, List[Variable]]:
+    # Variables that can conflict: same group or at least one common teacher
+    teachers_of = {
+        var: {teacher.name for _, _, teacher in domains_[var]} for var in variables_
+    }
+    return {
+        var: [
+            other
+            for other in variables_
+            if other is not var
+            and (
+                other.group_id == var.group_id
+                or not teachers_of[var].isdisjoint(teachers_of[other])
+            )
+        ]
+        for var in variables_
+    }
 
-# Domains
-domains: Dict[Variable, List[Tuple[str, int, Teacher]]] = {
-    var: [
-        (day, timeslot, teacher)
-        for day in days
-        for timeslot in timeslots
-        for teacher in TEACHERS
-        if var.subject in teacher.subjects
-    ]
-    for var in variables
-}
 
-# Constraints
-constraints = []
+def popcount(mask: int) -> int:
+    return bin(mask).count("1")
 
 
-# Constraint: Ensure each subject is taught the required number of hours per week for each group
-def subject_frequency_constraint(assignment: Assignment) -> bool:
-    scheduled_counts = {(var.group, var.subject): 0 for var in variables}
-    for var, _ in assignment.items():
-        scheduled_counts[(var.group, var.subject)] += 1
+def lowest_bit(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
 
-    for group in GROUPS:
-        for group_subject in group.subjects:
-            if scheduled_counts[(group, group_subject.subject)] > group_subject.hours:
-                return False
 
-    return True
+def iter_bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
 
-# Constraint: A teacher cannot teach more than one class at the same time
-def teacher_conflict_constraint(assignment: Assignment) -> bool:
-    teacher_times = {}
-    for var, (day, timeslot, teacher) in assignment.items():
-        if (teacher, day, timeslot) in teacher_times:
-            return False
-        teacher_times[(teacher, day, timeslot)] = True
+class Problem:
+    # The input models compiled for the solvers: interned variables, the
+    # bitset encoding of values, domains and the conflict graph.
+    # Every (day, timeslot, teacher) value is a bit, the values of the same
+    # (day, timeslot) are teachers_count consecutive bits
+    def __init__(
+        self,
+        groups: List[Group],
+        teachers: List[Teacher],
+        days_: List[str],
+        timeslots_: List[int],
+    ) -> None:
+        self.groups = groups
+        self.teachers = teachers
+        self.days = days_
+        self.timeslots = timeslots_
+        self.teachers_count = len(teachers)
+        self.values_index: List[Tuple[str, int, Teacher]] = [
+            (day, timeslot, teacher)
+            for day in days_
+            for timeslot in timeslots_
+            for teacher in teachers
+        ]
+        self.value_bits: Dict[Tuple[str, int, str], int] = {
+            (day, timeslot, teacher.name): bit
+            for bit, (day, timeslot, teacher) in enumerate(self.values_index)
+        }
+        self.slot_masks: List[int] = [
+            ((1 << self.teachers_count) - 1) << (slot * self.teachers_count)
+            for slot in range(len(days_) * len(timeslots_))
+        ]
+
+        self.subject_ids: Dict[str, int] = {}
+        self.subject_hours: Dict[Tuple[int, int], int] = {}
+        self.variables: List[Variable] = []
+        for group_id, group in enumerate(groups):
+            for group_subject in group.subjects:
+                subject = group_subject.subject
+                subject_id = self.subject_ids.setdefault(
+                    subject.name, len(self.subject_ids)
+                )
+                key = (group_id, subject_id)
+                self.subject_hours[key] = min(
+                    group_subject.hours,
+                    self.subject_hours.get(key, group_subject.hours),
+                )
+                for subject_no in range(group_subject.hours):
+                    self.variables.append(
+                        Variable(
+                            group,
+                            subject,
+                            subject_no,
+                            len(self.variables),
+                            group_id,
+                            subject_id,
+                        )
+                    )
+
+        teacher_subjects = [
+            {subject.name for subject in teacher.subjects} for teacher in teachers
+        ]
+        teacher_unavailable = [set(teacher.unavailable) for teacher in teachers]
+        self.domains: Dict[Variable, List[Tuple[str, int, Teacher]]] = {
+            var: [
+                value
+                for bit, value in enumerate(self.values_index)
+                if var.subject.name in teacher_subjects[bit % self.teachers_count]
+                and value[:2] not in teacher_unavailable[bit % self.teachers_count]
+            ]
+            for var in self.variables
+        }
+        self.domain_masks: Dict[Variable, int] = {
+            var: self.encode_domain(self.domains[var]) for var in self.variables
+        }
+        self.neighbours = build_neighbours(self.variables, self.domains)
+
+        # Lessons of the same (group, subject) are interchangeable
+        self.siblings: Dict[Variable, List[Variable]] = defaultdict(list)
+        for var in self.variables:
+            for other in self.neighbours[var]:
+                if (other.group_id, other.subject_id) == (
+                    var.group_id,
+                    var.subject_id,
+                ):
+                    self.siblings[var].append(other)
+        # So are teachers that every variable can take at the same timeslots
+        column = sum(
+            1 << (slot * self.teachers_count) for slot in range(len(self.slot_masks))
+        )
+        classes: Dict[Tuple[int, ...], List[int]] = defaultdict(list)
+        for teacher_id in range(self.teachers_count):
+            classes[
+                tuple(
+                    (self.domain_masks[var] >> teacher_id) & column
+                    for var in self.variables
+                )
+            ].append(teacher_id)
+        self.teacher_classes: List[List[int]] = [
+            teacher_ids for teacher_ids in classes.values() if len(teacher_ids) > 1
+        ]
+
+    def encode_value(self, value: Tuple[str, int, Teacher]) -> int:
+        day, timeslot, teacher = value
+        return self.value_bits[(day, timeslot, teacher.name)]
+
+    def encode_domain(self, values: List[Tuple[str, int, Teacher]]) -> int:
+        mask = 0
+        for value in values:
+            mask |= 1 << self.encode_value(value)
+        return mask
+
+    def decode_domain(self, mask: int) -> List[Tuple[str, int, Teacher]]:
+        return [self.values_index[bit] for bit in iter_bits(mask)]
+
+
+def compile_problem(
+    groups: List[Group],
+    teachers: List[Teacher],
+    days_: List[str],
+    timeslots_: List[int],
+) -> Problem:
+    return Problem(groups, teachers, days_, timeslots_)
+
+
+PROBLEM = compile_problem(GROUPS, TEACHERS, days, timeslots)
+
+# Variables
+variables: List[Variable] = PROBLEM.variables
+
+# Domains
+domains: Dict[Variable, List[Tuple[str, int, Teacher]]] = PROBLEM.domains
+
+# Inference after each assignment: None, "forward_checking" or "mac"
+# (maintaining arc consistency with AC-3)
+INFERENCE = "forward_checking"
+# "backtracking", "portfolio" (several strategies raced in a process pool)
+# "min_conflicts" (local search), "backjumping" (iterative, with
+# conflict-directed backjumping and nogood learning), "optimize" (best
+# soft cost found in OPTIMIZE_SECONDS) or "decomposed" (backtracking on every
+# independent part of the problem separately)
+SOLVER = "backtracking"
+PORTFOLIO_PROCESSES = os.cpu_count()
+# None solves the parts one after another in this process
+DECOMPOSITION_PROCESSES = None
+MIN_CONFLICTS_STEPS = 100000
+TABU_TENURE = 10
+RANDOM_WALK = 0.1
+MAX_NOGOOD_SIZE = 8
+# Node limit of a repair attempt before more of the old timetable is freed
+REPAIR_NODES = 10000
+# Compiled problems and their solutions are kept on disk, None disables it.
+# The least recently used entries are removed above CACHE_MAX_BYTES
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_MAX_BYTES = 64 * 2**20
+# Seconds after which a writer's temporary file is taken as left over by a crash
+CACHE_TEMPORARY_MAX_AGE = 3600
+# Part of every fingerprint, bump it when Problem changes
+CACHE_VERSION = 1
+# Order the lessons of the same (group, subject) by (day, timeslot) and only
+# try the first unused teacher out of interchangeable ones
+SYMMETRY_BREAKING = True
+# Soft cost for optimization: gaps in a group's day plus teacher lessons
+# above this many a day
+MAX_TEACHER_DAILY_LESSONS = 3
+OPTIMIZE_SECONDS = 5
+# Search trace: 0 off, 1 failed values, 2 also every assignment. Only every
+# TRACE_SAMPLE-th traced event is formatted and written
+TRACE_LEVEL = 0
+TRACE_SAMPLE = 1
+
+
+class SearchStats:
+    # Counters of one search: assignments tried (nodes), failed values per
+    # constraint or inference, deepest level and time spent in every
+    # heuristic. Trace messages are only built for enabled, sampled events
+    def __init__(
+        self,
+        trace: Callable[[str], None] = print,
+        level: int = TRACE_LEVEL,
+        sample: int = TRACE_SAMPLE,
+    ) -> None:
+        self.nodes = 0
+        self.failures: Dict[str, int] = Counter()
+        self.max_depth = 0
+        self.heuristic_time: Dict[str, float] = defaultdict(float)
+        self.backjumps = 0
+        self.nogoods = 0
+        self.trace = trace
+        self.level = level
+        self.sample = sample
+        self.events = 0
+
+    def assign(
+        self, depth: int, var: Variable, value: Tuple[str, int, Teacher]
+    ) -> None:
+        self.nodes += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self.level >= 2:
+            self.emit("assign", depth, var, value)
+
+    def fail(
+        self, reason: str, depth: int, var: Variable, value: Tuple[str, int, Teacher]
+    ) -> None:
+        self.failures[reason] += 1
+        if self.level >= 1:
+            self.emit(f"fail ({reason})", depth, var, value)
+
+    def emit(
+        self, event: str, depth: int, var: Variable, value: Tuple[str, int, Teacher]
+    ) -> None:
+        self.events += 1
+        if self.events % self.sample:
+            return
+        day, timeslot, teacher = value
+        self.trace(f"{event} at depth {depth}: {var} = {day} {timeslot} {teacher}")
+
+    def __repr__(self):
+        heuristic_time = {
+            name: round(seconds, 6) for name, seconds in self.heuristic_time.items()
+        }
+        return (
+            f"SearchStats(nodes={self.nodes}, max_depth={self.max_depth}, "
+            f"backjumps={self.backjumps}, nogoods={self.nogoods}, "
+            f"failures={dict(self.failures)}, heuristic_time={heuristic_time})"
+        )
+
+
+class SearchState:
+    # Occupied (teacher, day, timeslot) values and (group, day, timeslot)
+    # slots and per-(group, subject) lesson counts of the current partial
+    # assignment. Updated on assign and undone on backtrack, so checking a
+    # value is O(1). Also holds the current (pruned) bitset domains, the trail
+    # to restore them and how many values of unassigned variables' domains use
+    # every (group, day, timeslot), (teacher, day, timeslot) and
+    # (group, teacher, day, timeslot) for the least-constraining-value order.
+    # Groups and subjects are the problem's integer ids
+    def __init__(
+        self, problem: Problem, domains_: Optional[Dict[Variable, int]] = None
+    ) -> None:
+        self.problem = problem
+        self.domains = dict(problem.domain_masks if domains_ is None else domains_)
+        self.trail: List[Tuple[Variable, int]] = []
+        self.teacher_slots: Set[int] = set()
+        self.group_slots: Set[Tuple[int, int]] = set()
+        self.subject_counts: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.subject_hours = problem.subject_hours
+
+        self.group_slot_counts: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.teacher_slot_counts: List[int] = [0] * len(problem.values_index)
+        self.group_teacher_slot_counts: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.indexed: Set[Variable] = set()
+        for var, mask in self.domains.items():
+            self.index_values(var, mask, 1)
+            self.indexed.add(var)
+
+        # Symmetry breaking, see break_symmetries
+        self.symmetry = False
+        self.siblings: Dict[Variable, Set[Variable]] = {}
+        self.slots: Dict[Variable, int] = {}
+        self.teacher_loads = [0] * problem.teachers_count
+
+    def break_symmetries(self, fixed: Set[Variable]) -> None:
+        # Lessons of the same (group, subject) must take increasing
+        # (day, timeslot) in subject_no order. Fixed lessons can't be
+        # renumbered, so they are left out of the order
+        self.symmetry = True
+        self.siblings = {
+            var: {other for other in siblings if other not in fixed}
+            for var, siblings in self.problem.siblings.items()
+            if var not in fixed
+        }
+
+    def order_masks(self, var: Variable, bit: int) -> Tuple[int, int]:
+        # Values left to the lessons numbered before and after var = bit
+        teachers_count = self.problem.teachers_count
+        slot = bit // teachers_count
+        before = (1 << (slot * teachers_count)) - 1
+        after = ~((1 << ((slot + 1) * teachers_count)) - 1)
+        return before, after
+
+    def interchangeable_values(self, bits: List[int]) -> List[int]:
+        # Keeps the order of bits but drops the values of unused teachers
+        # when an interchangeable unused teacher with a lower id is there
+        skipped: Set[int] = set()
+        for teacher_ids in self.problem.teacher_classes:
+            unused = [t for t in teacher_ids if not self.teacher_loads[t]]
+            skipped.update(unused[1:])
+        if not skipped:
+            return bits
+        teachers_count = self.problem.teachers_count
+        return [bit for bit in bits if bit % teachers_count not in skipped]
+
+    def index_values(self, var: Variable, mask: int, delta: int) -> None:
+        group_id = var.group_id
+        teachers_count = self.problem.teachers_count
+        group_slot_counts = self.group_slot_counts
+        teacher_slot_counts = self.teacher_slot_counts
+        group_teacher_slot_counts = self.group_teacher_slot_counts
+        for bit in iter_bits(mask):
+            group_slot_counts[(group_id, bit // teachers_count)] += delta
+            teacher_slot_counts[bit] += delta
+            group_teacher_slot_counts[(group_id, bit)] += delta
+
+    def conflict(self, var: Variable, bit: int) -> Optional[str]:
+        # Name of the constraint var = bit would violate, if any
+        if bit in self.teacher_slots:
+            return "teacher_conflict_constraint"
+        if (var.group_id, bit // self.problem.teachers_count) in self.group_slots:
+            return "timeslot_availability_within_a_group_constraint"
+        key = (var.group_id, var.subject_id)
+        if self.subject_counts[key] >= self.subject_hours[key]:
+            return "subject_frequency_constraint"
+        if self.symmetry:
+            slot = bit // self.problem.teachers_count
+            for other in self.siblings.get(var, ()):
+                other_slot = self.slots.get(other)
+                if other_slot is not None and (other_slot < slot) != (
+                    other.subject_no < var.subject_no
+                ):
+                    return "lesson_order"
+        return None
+
+    def is_consistent(self, var: Variable, bit: int) -> bool:
+        return self.conflict(var, bit) is None
+
+    def assign(self, var: Variable, bit: int) -> None:
+        self.teacher_slots.add(bit)
+        self.group_slots.add((var.group_id, bit // self.problem.teachers_count))
+        self.subject_counts[(var.group_id, var.subject_id)] += 1
+        self.slots[var] = bit // self.problem.teachers_count
+        self.teacher_loads[bit % self.problem.teachers_count] += 1
+        self.index_values(var, self.domains[var], -1)
+        self.indexed.discard(var)
+
+    def unassign(self, var: Variable, bit: int) -> None:
+        self.teacher_slots.discard(bit)
+        self.group_slots.discard((var.group_id, bit // self.problem.teachers_count))
+        self.subject_counts[(var.group_id, var.subject_id)] -= 1
+        del self.slots[var]
+        self.teacher_loads[bit % self.problem.teachers_count] -= 1
+        self.index_values(var, self.domains[var], 1)
+        self.indexed.add(var)
+
+    def set_domain(self, var: Variable, mask: int) -> None:
+        if var in self.indexed:
+            old_mask = self.domains[var]
+            self.index_values(var, old_mask & ~mask, -1)
+            self.index_values(var, mask & ~old_mask, 1)
+        self.domains[var] = mask
+
+    def prune(self, var: Variable, mask: int) -> None:
+        self.trail.append((var, self.domains[var]))
+        self.set_domain(var, mask)
+
+    def restore(self, mark: int) -> None:
+        while len(self.trail) > mark:
+            var, mask = self.trail.pop()
+            self.set_domain(var, mask)
+
+
+def forward_check(
+    state: SearchState, var: Variable, bit: int, assignment: Assignment
+) -> bool:
+    # Removes the values conflicting with var = bit from the domains of the
+    # unassigned neighbours, fails as soon as one of them is empty
+    problem = state.problem
+    group_conflicts = ~problem.slot_masks[bit // problem.teachers_count]
+    teacher_conflicts = ~(1 << bit)
+    if state.symmetry:
+        before, after = state.order_masks(var, bit)
+        siblings = state.siblings.get(var, ())
+    for other in problem.neighbours[var]:
+        if other in assignment:
+            continue
+        mask = state.domains[other]
+        if other.group_id == var.group_id:
+            kept = mask & group_conflicts
+            if state.symmetry and other in siblings:
+                if other.subject_no < var.subject_no:
+                    kept &= before
+                else:
+                    kept &= after
+        else:
+            kept = mask & teacher_conflicts
+        if kept != mask:
+            state.prune(other, kept)
+            if not kept:
+                return False
     return True
 
 
-# Constraint: No group should have more than one class at a time
-def timeslot_availability_within_a_group_constraint(assignment: Assignment) -> bool:
-    group_times = {}
-    for var, (day, timeslot, _) in assignment.items():
-        if (var.group, day, timeslot) in group_times:
+def revise(state: SearchState, var: Variable, other: Variable) -> bool:
+    # Removes the values of var that have no compatible value left for other.
+    # Within a group a value loses its support only if all of other's values
+    # are at the same timeslot (or, for ordered lessons, at no later/earlier
+    # timeslot), otherwise only if other has just that value
+    problem = state.problem
+    teachers_count = problem.teachers_count
+    other_mask = state.domains[other]
+    mask = state.domains[var]
+    if not other_mask:
+        kept = 0
+    elif var.group_id == other.group_id:
+        kept = mask
+        slot_mask = problem.slot_masks[lowest_bit(other_mask) // teachers_count]
+        if not other_mask & ~slot_mask:
+            kept &= ~slot_mask
+        if other in state.siblings.get(var, ()):
+            if var.subject_no < other.subject_no:
+                last_slot = (other_mask.bit_length() - 1) // teachers_count
+                kept &= (1 << (last_slot * teachers_count)) - 1
+            else:
+                first_slot = lowest_bit(other_mask) // teachers_count
+                kept &= ~((1 << ((first_slot + 1) * teachers_count)) - 1)
+    else:
+        if other_mask & (other_mask - 1):
             return False
-        group_times[(var.group, day, timeslot)] = True
+        kept = mask & ~other_mask
+    if kept == mask:
+        return False
+    state.prune(var, kept)
     return True
 
 
-constraints += [
-    teacher_conflict_constraint,
-    timeslot_availability_within_a_group_constraint,
-    subject_frequency_constraint,
-]
+def ac3(
+    state: SearchState,
+    assignment: Assignment,
+    arcs: List[Tuple[Variable, Variable]],
+) -> bool:
+    queue = deque(arcs)
+    while queue:
+        var, other = queue.popleft()
+        if revise(state, var, other):
+            if not state.domains[var]:
+                return False
+            for next_var in state.problem.neighbours[var]:
+                if next_var is not other and next_var not in assignment:
+                    queue.append((next_var, var))
+    return True
 
 
-def least_constraining_value_heuristics(
+def infer(
+    state: SearchState,
     var: Variable,
+    bit: int,
     assignment: Assignment,
-    domains_: Dict[Variable, List[Tuple[str, int, Teacher]]],
-) -> List[Tuple[str, int, Teacher]]:
-    unassigned_vars = [v for v in variables if v not in assignment and v != var]
-
-    def count_legal_values(value: Tuple[str, int, Teacher]) -> int:
-        # Count how many legal values are left for other variables if 'value' is chosen for 'var'
-        count = 0
-        for other_var in unassigned_vars:
-            for other_value in domains_[other_var]:
-                if not constraints_conflict(var, value, other_var, other_value):
-                    count += 1
-        return count
-
-    return sorted(domains_[var], key=count_legal_values, reverse=True)
-
-
-def constraints_conflict(
-    var1: Variable,
-    value1: Tuple[str, int, Teacher],
-    var2: Variable,
-    value2: Tuple[str, int, Teacher],
+    inference: Optional[str],
 ) -> bool:
-    # Check if assigning value1 to var1 and value2 to var2 would violate any constraint
-    day1, timeslot1, teacher1 = value1
-    day2, timeslot2, teacher2 = value2
+    if inference is None:
+        return True
+    if inference == "forward_checking":
+        return forward_check(state, var, bit, assignment)
+    if inference == "mac":
+        state.prune(var, 1 << bit)
+        return ac3(
+            state,
+            assignment,
+            [
+                (other, var)
+                for other in state.problem.neighbours[var]
+                if other not in assignment
+            ],
+        )
+    raise ValueError(f"Unknown inference: {inference}")
 
-    if var1.group == var2.group and day1 == day2 and timeslot1 == timeslot2:
-        return True  # Same group cannot have two classes at the same time
-    if teacher1 == teacher2 and day1 == day2 and timeslot1 == timeslot2:
-        return True  # A teacher cannot teach two classes at the same time
 
-    return False
+def least_constraining_value_heuristics(
+    var: Variable, state: SearchState, rng: Optional[random.Random] = None
+) -> List[int]:
+    group_id = var.group_id
+    teachers_count = state.problem.teachers_count
+    bits = list(iter_bits(state.domains[var]))
+    if rng is not None:
+        # Random tie-breaking, the sort below is stable
+        rng.shuffle(bits)
+    # var's own values are still counted in the index
+    own_slot_counts = Counter(bit // teachers_count for bit in bits)
+
+    def count_eliminated_values(bit: int) -> int:
+        # Count how many values of other unassigned variables 'bit' rules out:
+        # same group or same teacher at the same time, counting both only once
+        slot = bit // teachers_count
+        return (
+            state.group_slot_counts[(group_id, slot)]
+            - own_slot_counts[slot]
+            + state.teacher_slot_counts[bit]
+            - state.group_teacher_slot_counts[(group_id, bit)]
+        )
+
+    return sorted(bits, key=count_eliminated_values)
+
+
+def random_value_heuristics(
+    var: Variable, state: SearchState, rng: Optional[random.Random] = None
+) -> List[int]:
+    bits = list(iter_bits(state.domains[var]))
+    (rng or random).shuffle(bits)
+    return bits
 
 
 def degree_heuristic(
     variables_: List[Variable],
     assignment: Assignment,
-    domains_: Dict[Variable, List[Tuple[str, int, Teacher]]],
+    domains_: Dict[Variable, int],
 ) -> Optional[Variable]:
     unassigned_vars = [v for v in variables_ if v not in assignment]
     if not unassigned_vars:
         return None
 
     def constraint_degree(var: Variable) -> int:
+        # O(n) per variable, so a portfolio worker checks its stop flag here
+        # too rather than only once per node
+        if _stop_event is not None and _stop_event.is_set():
+            raise SearchAborted("stopped")
         count = 0
         for other_var in unassigned_vars:
-            if other_var != var:
-                shared_domains = set(domains_[var]) & set(domains_[other_var])
-                count += len(shared_domains)
+            if other_var is not var:
+                count += popcount(domains_[var] & domains_[other_var])
         return count
 
     return max(unassigned_vars, key=constraint_degree, default=None)
@@ -296,18 +780,18 @@ def degree_heuristic(
 def least_domains_heuristics(
     variables_: List[Variable],
     assignment: Assignment,
-    domains_: Dict[Variable, List[Tuple[str, int, Teacher]]],
+    domains_: Dict[Variable, int],
 ) -> Optional[Variable]:
     unassigned_vars = [v for v in variables_ if v not in assignment]
     if not unassigned_vars:
         return None
-    return min(unassigned_vars, key=lambda var: len(domains_[var]), default=None)
+    return min(unassigned_vars, key=lambda var: popcount(domains_[var]), default=None)
 
 
 def select_unassigned_variable(
     variables_: List[Variable],
     assignment: Assignment,
-    domains_: Dict[Variable, List[Tuple[str, int, Teacher]]],
+    domains_: Dict[Variable, int],
 ) -> Optional[Variable]:
     unassigned_vars = [v for v in variables_ if v not in assignment]
     if not unassigned_vars:
@@ -315,46 +799,1177 @@ def select_unassigned_variable(
     return unassigned_vars[0]
 
 
+VARIABLE_ORDERINGS = {
+    "first": select_unassigned_variable,
+    "mrv": least_domains_heuristics,
+    "degree": degree_heuristic,
+}
+VALUE_ORDERINGS = {
+    "lcv": least_constraining_value_heuristics,
+    "random": random_value_heuristics,
+}
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchControl:
+    # Randomized tie-breaking, the node limit of a restart, the stop flag of
+    # a portfolio run and the deadline of an anytime search for one search.
+    # The variable order is shuffled once per restart, the heuristics pick
+    # the first of equally good variables
+    def __init__(
+        self,
+        rng: Optional[random.Random] = None,
+        node_limit: Optional[int] = None,
+        stop_event=None,
+        problem: Problem = PROBLEM,
+        deadline: Optional[float] = None,
+    ) -> None:
+        self.rng = rng
+        self.node_limit = node_limit
+        self.stop_event = stop_event
+        self.deadline = deadline
+        self.nodes = 0
+        self.variable_order = list(problem.variables)
+        if rng is not None:
+            rng.shuffle(self.variable_order)
+
+    def visit(self) -> None:
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchAborted("node limit reached")
+        # Checked on every node, a node of a slow heuristic can take long
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted("stopped")
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchAborted("time limit reached")
+
+
+class SoftCost:
+    # Soft cost of a (partial) assignment: free timeslots between the lessons
+    # of a group's day (gaps) plus every lesson of a teacher above
+    # max_daily_lessons a day. Updated on assign and undone on backtrack like
+    # SearchState. A remaining lesson of a group can fill at most one of its
+    # gaps and overload never goes down, so lower_bound never exceeds the
+    # cost of any completion
+    def __init__(
+        self, problem: Problem, max_daily_lessons: int = MAX_TEACHER_DAILY_LESSONS
+    ) -> None:
+        self.problem = problem
+        self.max_daily_lessons = max_daily_lessons
+        self.timeslots_count = len(problem.timeslots)
+        self.day_masks: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.gaps = [0] * len(problem.groups)
+        self.remaining = [0] * len(problem.groups)
+        for var in problem.variables:
+            self.remaining[var.group_id] += 1
+        self.group_bound = 0
+        self.teacher_loads: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.overload = 0
+        # Cost of the best solution so far, branches that can't beat it are cut
+        self.best = float("inf")
+
+    def update(self, var: Variable, bit: int, delta: int) -> None:
+        teacher_id = bit % self.problem.teachers_count
+        day, timeslot = divmod(bit // self.problem.teachers_count, self.timeslots_count)
+        group_id = var.group_id
+
+        self.group_bound -= max(0, self.gaps[group_id] - self.remaining[group_id])
+        mask = self.day_masks[(group_id, day)]
+        self.gaps[group_id] -= day_gaps(mask)
+        mask ^= 1 << timeslot
+        self.day_masks[(group_id, day)] = mask
+        self.gaps[group_id] += day_gaps(mask)
+        self.remaining[group_id] -= delta
+        self.group_bound += max(0, self.gaps[group_id] - self.remaining[group_id])
+
+        load = self.teacher_loads[(teacher_id, day)]
+        if delta > 0 and load >= self.max_daily_lessons:
+            self.overload += 1
+        elif delta < 0 and load > self.max_daily_lessons:
+            self.overload -= 1
+        self.teacher_loads[(teacher_id, day)] = load + delta
+
+    def assign(self, var: Variable, bit: int) -> None:
+        self.update(var, bit, 1)
+
+    def unassign(self, var: Variable, bit: int) -> None:
+        self.update(var, bit, -1)
+
+    def lower_bound(self) -> int:
+        return self.group_bound + self.overload
+
+    def cost(self) -> int:
+        return sum(self.gaps) + self.overload
+
+
+def day_gaps(mask: int) -> int:
+    # Free timeslots between the first and the last lesson of a day
+    if not mask:
+        return 0
+    return mask.bit_length() - lowest_bit(mask) - popcount(mask)
+
+
+def soft_cost(
+    assignment: Assignment,
+    problem: Problem = PROBLEM,
+    max_daily_lessons: int = MAX_TEACHER_DAILY_LESSONS,
+) -> int:
+    cost = SoftCost(problem, max_daily_lessons)
+    for var, value in assignment.items():
+        cost.assign(var, problem.encode_value(value))
+    return cost.cost()
+
+
+def search(
+    assignment: Assignment,
+    depth: int = 0,
+    state: Optional[SearchState] = None,
+    inference: Optional[str] = INFERENCE,
+    select_variable=least_domains_heuristics,
+    order_values=least_constraining_value_heuristics,
+    control: Optional[SearchControl] = None,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+    symmetry: bool = SYMMETRY_BREAKING,
+    cost: Optional[SoftCost] = None,
+) -> Iterator[Assignment]:
+    # Yields every solution extending the assignment, lazily. The assignment
+    # is extended in place, so every yielded solution is the same dict and
+    # has to be copied to be kept. With a cost, branches whose lower bound
+    # isn't below cost.best are cut
+    if stats is None:
+        stats = SearchStats()
+    if state is None:
+        state = SearchState(problem)
+        if symmetry:
+            state.break_symmetries(set(assignment))
+        for assigned_var, value in assignment.items():
+            bit = problem.encode_value(value)
+            if not state.is_consistent(assigned_var, bit):
+                return
+            state.assign(assigned_var, bit)
+            if cost is not None:
+                cost.assign(assigned_var, bit)
+            if not infer(state, assigned_var, bit, assignment, inference):
+                return
+        if inference == "mac" and not ac3(
+            state,
+            assignment,
+            [
+                (var, other)
+                for var in problem.variables
+                if var not in assignment
+                for other in problem.neighbours[var]
+                if other not in assignment
+            ],
+        ):
+            return
+    problem = state.problem
+
+    if len(assignment) == len(problem.variables):
+        yield assignment
+        return
+
+    started = time.perf_counter()
+    if control is not None:
+        control.visit()
+        var = select_variable(control.variable_order, assignment, state.domains)
+    else:
+        var = select_variable(problem.variables, assignment, state.domains)
+    selected = time.perf_counter()
+    stats.heuristic_time[select_variable.__name__] += selected - started
+
+    if var is None:
+        return
+
+    if control is not None:
+        values = order_values(var, state, control.rng)
+    else:
+        values = order_values(var, state)
+    if state.symmetry:
+        values = state.interchangeable_values(values)
+    stats.heuristic_time[order_values.__name__] += time.perf_counter() - selected
+
+    for bit in values:
+        value = problem.values_index[bit]
+        reason = state.conflict(var, bit)
+        if reason is not None:
+            stats.fail(reason, depth, var, value)
+            continue
+
+        assignment[var] = value
+        state.assign(var, bit)
+        stats.assign(depth, var, value)
+        mark = len(state.trail)
+        started = time.perf_counter()
+        consistent = infer(state, var, bit, assignment, inference)
+        if inference is not None:
+            stats.heuristic_time[inference] += time.perf_counter() - started
+            if not consistent:
+                stats.fail(inference, depth, var, value)
+        if cost is not None:
+            cost.assign(var, bit)
+            if consistent and cost.lower_bound() >= cost.best:
+                stats.fail("bound", depth, var, value)
+                consistent = False
+        if consistent:
+            yield from search(
+                assignment,
+                depth + 1,
+                state,
+                inference,
+                select_variable,
+                order_values,
+                control,
+                stats,
+                problem,
+                symmetry,
+                cost,
+            )
+        if cost is not None:
+            cost.unassign(var, bit)
+        state.restore(mark)
+        state.unassign(var, bit)
+        del assignment[var]
+
+
 def backtrack(
-    assignment: Assignment, depth: int = 0
+    assignment: Assignment,
+    depth: int = 0,
+    state: Optional[SearchState] = None,
+    inference: Optional[str] = INFERENCE,
+    select_variable=least_domains_heuristics,
+    order_values=least_constraining_value_heuristics,
+    control: Optional[SearchControl] = None,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+    symmetry: bool = SYMMETRY_BREAKING,
 ) -> Optional[Dict[Variable, Tuple[str, int, Teacher]]]:
-    if len(assignment) == len(variables):
-        return assignment
+    # The first solution, extending the assignment in place
+    for solution in search(
+        assignment,
+        depth,
+        state,
+        inference,
+        select_variable,
+        order_values,
+        control,
+        stats,
+        problem,
+        symmetry,
+    ):
+        return solution
+    return None
 
-    # #1
-    # var = select_unassigned_variable(variables, assignment, domains)
-    # #2
-    var = least_domains_heuristics(variables, assignment, domains)
-    # #3
-    # var = degree_heuristic(variables, assignment, domains)
 
-    if var is None:
+def iter_solutions(
+    assignment: Optional[Assignment] = None,
+    inference: Optional[str] = INFERENCE,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+    symmetry: bool = SYMMETRY_BREAKING,
+) -> Iterator[Assignment]:
+    # Solutions one by one as the search finds them. With symmetry breaking
+    # only one of every set of solutions that differ by swapping lessons of
+    # the same subject or interchangeable teachers is yielded
+    for solution in search(
+        dict(assignment or {}),
+        inference=inference,
+        stats=stats,
+        problem=problem,
+        symmetry=symmetry,
+    ):
+        yield dict(solution)
+
+
+def optimize(
+    assignment: Optional[Assignment] = None,
+    inference: Optional[str] = INFERENCE,
+    control: Optional[SearchControl] = None,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+    symmetry: bool = SYMMETRY_BREAKING,
+    max_daily_lessons: int = MAX_TEACHER_DAILY_LESSONS,
+) -> Iterator[Tuple[int, Assignment]]:
+    # Branch and bound on the soft cost: yields (cost, solution) every time a
+    # cheaper solution is found, the last one is optimal
+    cost = SoftCost(problem, max_daily_lessons)
+    for solution in search(
+        dict(assignment or {}),
+        inference=inference,
+        control=control,
+        stats=stats,
+        problem=problem,
+        symmetry=symmetry,
+        cost=cost,
+    ):
+        cost.best = cost.cost()
+        yield cost.best, dict(solution)
+
+
+def best_within(
+    seconds: float,
+    assignment: Optional[Assignment] = None,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+) -> Optional[Tuple[int, Assignment]]:
+    # Anytime optimization: the cheapest solution found in the time limit
+    best = None
+    control = SearchControl(deadline=time.perf_counter() + seconds, problem=problem)
+    try:
+        for best in optimize(assignment, control=control, stats=stats, problem=problem):
+            pass
+    except SearchAborted:
+        pass
+    return best
+
+
+class Strategy(pydantic.BaseModel):
+    variable_ordering: str = "mrv"
+    value_ordering: str = "lcv"
+    inference: Optional[str] = INFERENCE
+    # Randomized tie-breaking, None keeps the search deterministic
+    seed: Optional[int] = None
+    # Node limit of the first restart, doubled on every restart.
+    # None searches without restarts
+    restart_nodes: Optional[int] = None
+
+
+PORTFOLIO = [
+    Strategy(variable_ordering="mrv", value_ordering="lcv"),
+    Strategy(variable_ordering="mrv", value_ordering="lcv", inference="mac"),
+    Strategy(variable_ordering="degree", value_ordering="lcv"),
+    Strategy(variable_ordering="first", value_ordering="lcv"),
+    *(
+        Strategy(value_ordering=value_ordering, seed=seed, restart_nodes=100)
+        for value_ordering in ("lcv", "random")
+        for seed in range(2)
+    ),
+]
+
+
+def solve_with_strategy(
+    strategy: Strategy,
+    assignment: Optional[Assignment] = None,
+    stop_event=None,
+    problem: Problem = PROBLEM,
+) -> Optional[Assignment]:
+    rng = random.Random(strategy.seed) if strategy.seed is not None else None
+    node_limit = strategy.restart_nodes
+    while True:
+        try:
+            return backtrack(
+                dict(assignment or {}),
+                inference=strategy.inference,
+                select_variable=VARIABLE_ORDERINGS[strategy.variable_ordering],
+                order_values=VALUE_ORDERINGS[strategy.value_ordering],
+                control=SearchControl(rng, node_limit, stop_event, problem),
+                problem=problem,
+            )
+        except SearchAborted:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            # Only a node limit aborts a search that wasn't stopped
+            if node_limit is None:
+                raise
+            node_limit *= 2
+
+
+# Set in every portfolio worker, so the strategies can stop once one wins
+_stop_event = None
+
+
+def _init_portfolio_worker(stop_event) -> None:
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _run_strategy(strategy: Strategy, problem: Problem) -> Optional[List[int]]:
+    # The worker has its own copy of the problem, the solution goes back as
+    # the value bit of every variable in the order of problem.variables
+    result = solve_with_strategy(strategy, stop_event=_stop_event, problem=problem)
+    if result is None:
+        return None
+    return [problem.encode_value(result[var]) for var in problem.variables]
+
+
+def portfolio_solve(
+    strategies: Optional[List[Strategy]] = None,
+    processes: Optional[int] = PORTFOLIO_PROCESSES,
+    problem: Problem = PROBLEM,
+) -> Optional[Tuple[Strategy, Assignment]]:
+    # Races the strategies in a process pool. Whichever finishes first either
+    # found a solution or, as every search is complete, proved there is none,
+    # so the others are cancelled or stopped at their next check. It returns
+    # without waiting for them, the workers exit on their own
+    strategies = strategies or PORTFOLIO
+    stop_event = multiprocessing.Event()
+    executor = ProcessPoolExecutor(
+        max_workers=min(len(strategies), processes or 1),
+        initializer=_init_portfolio_worker,
+        initargs=(stop_event,),
+    )
+    try:
+        futures = {
+            executor.submit(_run_strategy, strategy, problem): strategy
+            for strategy in strategies
+        }
+        for future in as_completed(futures):
+            bits = future.result()
+            if bits is None:
+                return None
+            return futures[future], {
+                var: problem.values_index[bit]
+                for var, bit in zip(problem.variables, bits)
+            }
         return None
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def connected_components(problem: Problem = PROBLEM) -> List[List[Variable]]:
+    # Variables only interact with their neighbours, so every connected
+    # component of the conflict graph can be solved on its own
+    seen: Set[Variable] = set()
+    components = []
+    for var in problem.variables:
+        if var in seen:
+            continue
+        seen.add(var)
+        component = []
+        queue = deque([var])
+        while queue:
+            current = queue.popleft()
+            component.append(current)
+            for other in problem.neighbours[current]:
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+        components.append(sorted(component, key=lambda var: var.id))
+    return components
+
+
+def decompose(problem: Problem = PROBLEM) -> List[Problem]:
+    # A problem per component with only its groups and the teachers that can
+    # teach its lessons. The lessons of a group are all neighbours, so every
+    # group is in exactly one component and so is every teacher
+    components = connected_components(problem)
+    if len(components) <= 1:
+        return [problem]
+    subproblems = []
+    for component in components:
+        group_ids = {var.group_id for var in component}
+        teacher_names = {
+            teacher.name for var in component for _, _, teacher in problem.domains[var]
+        }
+        subproblems.append(
+            compile_problem(
+                [
+                    group
+                    for group_id, group in enumerate(problem.groups)
+                    if group_id in group_ids
+                ],
+                [
+                    teacher
+                    for teacher in problem.teachers
+                    if teacher.name in teacher_names
+                ],
+                problem.days,
+                problem.timeslots,
+            )
+        )
+    return subproblems
+
+
+def solve_component(assignment: Assignment, problem: Problem) -> Optional[Assignment]:
+    try:
+        return backtrack(
+            assignment,
+            control=SearchControl(stop_event=_stop_event, problem=problem),
+            problem=problem,
+        )
+    except SearchAborted:
+        return None
+
 
-    for value in least_constraining_value_heuristics(var, assignment, domains):
-        new_assignment = assignment.copy()
-        new_assignment[var] = value
+def _run_component(
+    solve: Callable[[Assignment, Problem], Optional[Assignment]],
+    assignment: Assignment,
+    problem: Problem,
+) -> Optional[List[int]]:
+    result = solve(assignment, problem)
+    if result is None:
+        return None
+    return [problem.encode_value(result[var]) for var in problem.variables]
+
+
+def decomposed_solve(
+    assignment: Optional[Assignment] = None,
+    solve: Callable[[Assignment, Problem], Optional[Assignment]] = solve_component,
+    processes: Optional[int] = DECOMPOSITION_PROCESSES,
+    problem: Problem = PROBLEM,
+) -> Optional[Assignment]:
+    # Solves the independent parts of the problem separately, in a process
+    # pool if processes is set, and merges their solutions. There is no
+    # solution as soon as one of the parts has none
+    assignment = assignment or {}
+    parts = [
+        ({var: assignment[var] for var in sub.variables if var in assignment}, sub)
+        for sub in decompose(problem)
+    ]
+    merged: Assignment = {}
+    if not processes or len(parts) == 1:
+        for part, sub in parts:
+            result = solve(part, sub)
+            if result is None:
+                return None
+            merged.update(result)
+        return {var: merged[var] for var in problem.variables}
+
+    stop_event = multiprocessing.Event()
+    executor = ProcessPoolExecutor(
+        max_workers=min(len(parts), processes),
+        initializer=_init_portfolio_worker,
+        initargs=(stop_event,),
+    )
+    try:
+        futures = {
+            executor.submit(_run_component, solve, part, sub): sub
+            for part, sub in parts
+        }
+        for future in as_completed(futures):
+            bits = future.result()
+            if bits is None:
+                return None
+            sub = futures[future]
+            merged.update(
+                {var: sub.values_index[bit] for var, bit in zip(sub.variables, bits)}
+            )
+        return {var: merged[var] for var in problem.variables}
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Frame:
+    # A variable on the explicit search stack: its values in the order they
+    # are tried, the trail mark before its assignment, the variables its
+    # forward checking pruned and the earlier variables its failures depend on
+    __slots__ = ("var", "values", "next_value", "mark", "pruned", "conflicts")
+
+    def __init__(self, var: Variable, values: List[int]) -> None:
+        self.var = var
+        self.values = values
+        self.next_value = 0
+        self.mark = 0
+        self.pruned: List[Variable] = []
+        self.conflicts: Set[Variable] = set()
+
+
+def backjump_search(
+    assignment: Optional[Assignment] = None,
+    max_nogood_size: int = MAX_NOGOOD_SIZE,
+    stats: Optional[SearchStats] = None,
+    problem: Problem = PROBLEM,
+    symmetry: bool = SYMMETRY_BREAKING,
+) -> Tuple[Optional[Assignment], SearchStats]:
+    # Iterative forward checking with conflict-directed backjumping. When a
+    # variable runs out of values the search jumps back to the deepest
+    # variable responsible for it, and their current values are learned as
+    # a nogood (up to max_nogood_size values) that is never tried again.
+    # A nogood of one value is a (teacher, day, timeslot) proven infeasible
+    # for that lesson
+    if stats is None:
+        stats = SearchStats()
+    assignment = dict(assignment or {})
+    state = SearchState(problem)
+    if symmetry:
+        state.break_symmetries(set(assignment))
+    teachers_count = problem.teachers_count
+    neighbours_ = problem.neighbours
+    values: Dict[Variable, int] = {}
+    levels: Dict[Variable, int] = {}
+    # Earlier variables whose forward checking removed values of a variable
+    pruned_by: Dict[Variable, List[Variable]] = defaultdict(list)
+    # Nogoods are kept as sorted (variable id, value) tuples, indexed by
+    # every (variable id, value) in them, with the current value of every
+    # variable by id (-1 when unassigned) to check them without hashing
+    current = [-1] * len(problem.variables)
+    nogoods: Dict[Tuple[int, int], List[Tuple[Tuple[int, int], ...]]] = defaultdict(
+        list
+    )
+    learned: Set[Tuple[Tuple[int, int], ...]] = set()
+    stack: List[Frame] = []
+
+    def forward_check_cbj(var: Variable, bit: int, frame: Optional[Frame]) -> bool:
+        group_conflicts = ~problem.slot_masks[bit // teachers_count]
+        teacher_conflicts = ~(1 << bit)
+        if state.symmetry:
+            before, after = state.order_masks(var, bit)
+            siblings = state.siblings.get(var, ())
+        for other in neighbours_[var]:
+            if other in values:
+                continue
+            mask = state.domains[other]
+            if other.group_id == var.group_id:
+                kept = mask & group_conflicts
+                if state.symmetry and other in siblings:
+                    if other.subject_no < var.subject_no:
+                        kept &= before
+                    else:
+                        kept &= after
+            else:
+                kept = mask & teacher_conflicts
+            if kept != mask:
+                state.prune(other, kept)
+                pruned_by[other].append(var)
+                if frame is not None:
+                    frame.pruned.append(other)
+                if not kept:
+                    if frame is not None:
+                        frame.conflicts.update(pruned_by[other])
+                        frame.conflicts.discard(var)
+                    return False
+        return True
+
+    def violated_nogood(var: Variable, bit: int) -> Optional[Set[Variable]]:
+        var_id = var.id
+        for nogood in nogoods.get((var_id, bit), ()):
+            if all(
+                current[other_id] == value
+                for other_id, value in nogood
+                if other_id != var_id
+            ):
+                return {
+                    problem.variables[other_id]
+                    for other_id, _ in nogood
+                    if other_id != var_id
+                }
+        return None
 
-        if all(constraint(new_assignment) for constraint in constraints):
-            result = backtrack(new_assignment, depth + 1)
-            if result is not None:
-                return result
+    def learn(conflicts: Set[Variable]) -> None:
+        if not conflicts or len(conflicts) > max_nogood_size:
+            return
+        nogood = tuple(sorted((other.id, values[other]) for other in conflicts))
+        if nogood in learned:
+            return
+        learned.add(nogood)
+        for literal in nogood:
+            nogoods[literal].append(nogood)
+        stats.nogoods += 1
+
+    def undo(frame: Frame) -> None:
+        var = frame.var
+        state.restore(frame.mark)
+        for other in frame.pruned:
+            pruned_by[other].pop()
+        frame.pruned.clear()
+        state.unassign(var, values.pop(var))
+        current[var.id] = -1
+        del levels[var]
+        del assignment[var]
+
+    if not all(problem.domain_masks.values()):
+        return None, stats
+    for var, value in assignment.items():
+        bit = problem.encode_value(value)
+        if not state.is_consistent(var, bit):
+            return None, stats
+        values[var] = bit
+        current[var.id] = bit
+        state.assign(var, bit)
+        if not forward_check_cbj(var, bit, None):
+            return None, stats
+
+    frame: Optional[Frame] = None
+    while True:
+        if frame is None:
+            started = time.perf_counter()
+            next_var = least_domains_heuristics(
+                problem.variables, assignment, state.domains
+            )
+            selected = time.perf_counter()
+            stats.heuristic_time["least_domains_heuristics"] += selected - started
+            if next_var is None:
+                return assignment, stats
+            bits = least_constraining_value_heuristics(next_var, state)
+            if state.symmetry:
+                bits = state.interchangeable_values(bits)
+            frame = Frame(next_var, bits)
+            stats.heuristic_time["least_constraining_value_heuristics"] += (
+                time.perf_counter() - selected
+            )
+            stack.append(frame)
+
+        var = frame.var
+        depth = len(stack) - 1
+        descended = False
+        while frame.next_value < len(frame.values):
+            bit = frame.values[frame.next_value]
+            frame.next_value += 1
+            value = problem.values_index[bit]
+            nogood = violated_nogood(var, bit)
+            if nogood is not None:
+                stats.fail("nogood", depth, var, value)
+                frame.conflicts.update(nogood)
+                continue
+            reason = state.conflict(var, bit)
+            if reason is not None:
+                # Only the lesson count can fail after forward checking,
+                # blame every assigned variable
+                stats.fail(reason, depth, var, value)
+                frame.conflicts.update(values)
+                continue
+
+            stats.assign(depth, var, value)
+            values[var] = bit
+            current[var.id] = bit
+            levels[var] = depth
+            assignment[var] = value
+            state.assign(var, bit)
+            frame.mark = len(state.trail)
+            started = time.perf_counter()
+            consistent = forward_check_cbj(var, bit, frame)
+            stats.heuristic_time["forward_checking"] += time.perf_counter() - started
+            if consistent:
+                descended = True
+                break
+            stats.fail("forward_checking", depth, var, value)
+            undo(frame)
+
+        if descended:
+            frame = None
+            continue
+
+        # Out of values: every value of var was pruned by or failed because
+        # of the variables in its conflict set
+        conflicts = frame.conflicts | set(pruned_by[var])
+        stack.pop()
+        learn(conflicts)
+        searched = [other for other in conflicts if other in levels]
+        if not searched:
+            # Only the given assignment (or nothing) is to blame
+            return None, stats
+        target = max(searched, key=levels.__getitem__)
+        if stack[-1].var is not target:
+            stats.backjumps += 1
+        while stack[-1].var is not target:
+            undo(stack.pop())
+        frame = stack[-1]
+        frame.conflicts.update(conflicts)
+        frame.conflicts.discard(target)
+        undo(frame)
+
+
+class ConflictIndex:
+    # Current value bit of every variable of a complete assignment, the
+    # variables using every (group, day, timeslot) and (teacher, day,
+    # timeslot) and how many others each variable clashes with. Moving a
+    # variable only touches the variables of its old and new slots
+    def __init__(self, problem: Problem) -> None:
+        self.teachers_count = problem.teachers_count
+        self.values: Dict[Variable, int] = {}
+        self.group_vars: Dict[Tuple[int, int], Set[Variable]] = defaultdict(set)
+        self.teacher_vars: Dict[int, Set[Variable]] = defaultdict(set)
+        self.conflict_counts: Dict[Variable, int] = {}
+        # Conflicted variables, as a list with positions for O(1) removal
+        # and random choice
+        self.conflicted: List[Variable] = []
+        self.conflicted_pos: Dict[Variable, int] = {}
+
+    def conflicts(self, var: Variable, bit: int) -> int:
+        # Clashes of var = bit with the other variables
+        group_vars = self.group_vars[(var.group_id, bit // self.teachers_count)]
+        teacher_vars = self.teacher_vars[bit]
+        return (
+            len(group_vars)
+            - (var in group_vars)
+            + len(teacher_vars)
+            - (var in teacher_vars)
+        )
+
+    def set_count(self, var: Variable, count: int) -> None:
+        self.conflict_counts[var] = count
+        if count and var not in self.conflicted_pos:
+            self.conflicted_pos[var] = len(self.conflicted)
+            self.conflicted.append(var)
+        elif not count and var in self.conflicted_pos:
+            pos = self.conflicted_pos.pop(var)
+            last = self.conflicted.pop()
+            if last is not var:
+                self.conflicted[pos] = last
+                self.conflicted_pos[last] = pos
+
+    def remove(self, var: Variable) -> None:
+        bit = self.values.pop(var)
+        group_vars = self.group_vars[(var.group_id, bit // self.teachers_count)]
+        teacher_vars = self.teacher_vars[bit]
+        group_vars.discard(var)
+        teacher_vars.discard(var)
+        for other in group_vars:
+            self.set_count(other, self.conflict_counts[other] - 1)
+        for other in teacher_vars:
+            self.set_count(other, self.conflict_counts[other] - 1)
+        self.set_count(var, 0)
+
+    def add(self, var: Variable, bit: int) -> None:
+        group_vars = self.group_vars[(var.group_id, bit // self.teachers_count)]
+        teacher_vars = self.teacher_vars[bit]
+        for other in group_vars:
+            self.set_count(other, self.conflict_counts[other] + 1)
+        for other in teacher_vars:
+            self.set_count(other, self.conflict_counts[other] + 1)
+        self.set_count(var, len(group_vars) + len(teacher_vars))
+        group_vars.add(var)
+        teacher_vars.add(var)
+        self.values[var] = bit
+
+    def move(self, var: Variable, bit: int) -> None:
+        self.remove(var)
+        self.add(var, bit)
+
+    def total_conflicts(self) -> int:
+        return sum(self.conflict_counts.values()) // 2
+
+
+def greedy_assignment(
+    domain_bits: Dict[Variable, List[int]],
+    rng: random.Random,
+    problem: Problem = PROBLEM,
+) -> ConflictIndex:
+    # Smallest domains first, every variable takes a least conflicting value
+    index = ConflictIndex(problem)
+    for var in sorted(problem.variables, key=lambda var: len(domain_bits[var])):
+        bits = domain_bits[var]
+        best = min(index.conflicts(var, bit) for bit in bits)
+        index.add(
+            var, rng.choice([bit for bit in bits if index.conflicts(var, bit) == best])
+        )
+    return index
+
+
+def min_conflicts(
+    max_steps: int = MIN_CONFLICTS_STEPS,
+    tabu_tenure: int = TABU_TENURE,
+    random_walk: float = RANDOM_WALK,
+    seed: Optional[int] = None,
+    problem: Problem = PROBLEM,
+) -> Optional[Assignment]:
+    # Local search over complete assignments: repeatedly moves a random
+    # conflicted variable to its least conflicting value that isn't tabu,
+    # or with probability random_walk to a random value
+    rng = random.Random(seed)
+    domain_bits = {
+        var: list(iter_bits(problem.domain_masks[var])) for var in problem.variables
+    }
+    if not all(domain_bits.values()):
+        return None
+    index = greedy_assignment(domain_bits, rng, problem)
+    # (variable, value) -> step until which moving var back to value is tabu
+    tabu: Dict[Tuple[Variable, int], int] = {}
+
+    for step in range(max_steps):
+        if not index.conflicted:
+            return {var: problem.values_index[bit] for var, bit in index.values.items()}
+
+        var = rng.choice(index.conflicted)
+        current = index.values[var]
+        candidates = [bit for bit in domain_bits[var] if bit != current]
+        if not candidates:
+            continue
+        if rng.random() < random_walk:
+            bit = rng.choice(candidates)
         else:
-            print(f"Failed check at depth {depth} for {new_assignment}")
+            scores = {bit: index.conflicts(var, bit) for bit in candidates}
+            # A tabu value is still allowed if it removes all of var's conflicts
+            allowed = [
+                bit
+                for bit in candidates
+                if tabu.get((var, bit), -1) < step or scores[bit] == 0
+            ] or candidates
+            best = min(scores[bit] for bit in allowed)
+            bit = rng.choice([bit for bit in allowed if scores[bit] == best])
+
+        tabu[(var, current)] = step + tabu_tenure
+        index.move(var, bit)
 
     return None
 
 
+class Delta(pydantic.BaseModel):
+    # Teachers that can't teach at the given (day, timeslot) pairs, None for
+    # the whole week
+    unavailable: Dict[str, Optional[List[Tuple[str, int]]]] = {}
+    # New weekly hours by group and subject name, 0 drops the subject
+    hours: Dict[str, Dict[str, int]] = {}
+    # New groups, or new versions of the groups with the same name
+    groups: List[Group] = []
+
+
+def apply_delta(delta: Delta, problem: Problem = PROBLEM) -> Problem:
+    teachers = []
+    for teacher in problem.teachers:
+        if teacher.name in delta.unavailable:
+            slots = delta.unavailable[teacher.name]
+            if slots is None:
+                slots = [(day, ts) for day in problem.days for ts in problem.timeslots]
+            teacher = teacher.model_copy(
+                update={"unavailable": [*teacher.unavailable, *slots]}
+            )
+        teachers.append(teacher)
+
+    groups = {group.name: group for group in problem.groups}
+    groups.update({group.name: group for group in delta.groups})
+    for name, hours in delta.hours.items():
+        group = groups[name]
+        subjects = [
+            GroupSubject(
+                group_subject.subject,
+                hours.get(group_subject.subject.name, group_subject.hours),
+            )
+            for group_subject in group.subjects
+        ]
+        known = {group_subject.subject.name for group_subject in group.subjects}
+        subjects += [
+            GroupSubject(Subject(subject_name), subject_hours)
+            for subject_name, subject_hours in hours.items()
+            if subject_name not in known
+        ]
+        groups[name] = Group(
+            name, [group_subject for group_subject in subjects if group_subject.hours]
+        )
+
+    return compile_problem(
+        list(groups.values()), teachers, problem.days, problem.timeslots
+    )
+
+
+def repair(
+    previous: Assignment,
+    problem: Problem = PROBLEM,
+    inference: Optional[str] = INFERENCE,
+    node_limit: Optional[int] = REPAIR_NODES,
+    stats: Optional[SearchStats] = None,
+) -> Tuple[Optional[Assignment], int]:
+    # Solves a changed problem starting from the old solution. The old
+    # lessons that still fit are fixed and only the rest is searched. When
+    # that fails, the fixed lessons next to the searched ones are freed as
+    # well, ring by ring, until the whole timetable is searched.
+    # Returns the solution and how many of the old lessons moved
+    state = SearchState(problem)
+    kept: Assignment = {}
+    for var in problem.variables:
+        if var not in previous:
+            continue
+        day, timeslot, teacher = previous[var]
+        bit = problem.value_bits.get((day, timeslot, teacher.name))
+        if (
+            bit is None
+            or not problem.domain_masks[var] >> bit & 1
+            or not state.is_consistent(var, bit)
+        ):
+            continue
+        state.assign(var, bit)
+        kept[var] = problem.values_index[bit]
+
+    free = {var for var in problem.variables if var not in kept}
+    while True:
+        fixed = {var: value for var, value in kept.items() if var not in free}
+        control = None
+        if fixed and node_limit is not None:
+            control = SearchControl(node_limit=node_limit, problem=problem)
+        try:
+            solution = backtrack(
+                dict(fixed),
+                inference=inference,
+                control=control,
+                stats=stats,
+                problem=problem,
+            )
+        except SearchAborted:
+            solution = None
+        if solution is not None:
+            break
+        if not fixed:
+            return None, 0
+        ring = {other for var in free for other in problem.neighbours[var]} - free
+        free |= ring or set(fixed)
+
+    moved = 0
+    for var in problem.variables:
+        if var in previous:
+            day, timeslot, teacher = previous[var]
+            bit = problem.value_bits.get((day, timeslot, teacher.name))
+            moved += bit != problem.encode_value(solution[var])
+    return {var: solution[var] for var in problem.variables}, moved
+
+
+def resolve(
+    previous: Assignment,
+    delta: Delta,
+    problem: Problem = PROBLEM,
+) -> Tuple[Problem, Optional[Assignment], int]:
+    # The changed problem, its repaired solution and the moved lessons count
+    changed = apply_delta(delta, problem)
+    solution, moved = repair(previous, changed)
+    return changed, solution, moved
+
+
+def problem_fingerprint(
+    groups: List[Group],
+    teachers: List[Teacher],
+    days_: List[str],
+    timeslots_: List[int],
+) -> str:
+    # sha256 of the canonical JSON of the instance. Pickles refer to classes
+    # by module, which is __main__ when this file is run as a script
+    instance = {
+        "version": CACHE_VERSION,
+        "module": __name__,
+        "groups": [group.model_dump() for group in groups],
+        "teachers": [teacher.model_dump() for teacher in teachers],
+        "days": days_,
+        "timeslots": timeslots_,
+    }
+    encoded = json.dumps(
+        instance, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ProblemCache:
+    # A pickled (problem, solution) file per fingerprint, the solution as
+    # (variable id, value bit) pairs in its own order or None if there is
+    # none. Loading an entry touches it, storing one removes the entries with
+    # the oldest mtime until the directory fits in max_bytes. CACHE_DIR and
+    # CACHE_MAX_BYTES are the defaults at the time the cache is created
+    def __init__(
+        self, directory: Optional[str] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        if directory is None:
+            directory = CACHE_DIR
+        if directory is None:
+            raise ValueError("No cache directory, CACHE_DIR is None")
+        self.directory = directory
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def load(self, key: str) -> Optional[Tuple[Problem, Optional[Assignment]]]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                problem, bits = pickle.load(file)
+            if not isinstance(problem, Problem):
+                raise TypeError(f"Not a cached problem: {path}")
+            solution = None
+            if bits is not None:
+                solution = {
+                    problem.variables[var_id]: problem.values_index[bit]
+                    for var_id, bit in bits
+                }
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated, corrupted or of another shape, it is a miss and
+            # is stored again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return problem, solution
+
+    def store(self, key: str, problem: Problem, solution: Optional[Assignment]) -> None:
+        bits = None
+        if solution is not None:
+            # By key, the solution may use another problem's variables
+            ids = {var: var.id for var in problem.variables}
+            bits = [
+                (ids[var], problem.encode_value(value))
+                for var, value in solution.items()
+            ]
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # Written aside and renamed, so other processes never load half of it
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump((problem, bits), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self) -> None:
+        # Other processes may remove or replace entries meanwhile
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            is_temporary = name.endswith(".tmp")
+            if not is_temporary and not name.endswith(".pickle"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if is_temporary and now - stat.st_mtime >= CACHE_TEMPORARY_MAX_AGE:
+                    # Left over by a crashed writer
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            # Temporary files still being written count but aren't removed
+            if not is_temporary:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cached_solve(
+    groups: List[Group] = GROUPS,
+    teachers: List[Teacher] = TEACHERS,
+    days_: List[str] = days,
+    timeslots_: List[int] = timeslots,
+    cache: Optional[ProblemCache] = None,
+    stats: Optional[SearchStats] = None,
+) -> Tuple[Problem, Optional[Assignment], bool]:
+    # The compiled problem, its solution and whether they came from the
+    # cache. Otherwise the instance is compiled, solved and stored
+    cache = cache or ProblemCache()
+    key = problem_fingerprint(groups, teachers, days_, timeslots_)
+    cached = cache.load(key)
+    if cached is not None:
+        return (*cached, True)
+    problem = compile_problem(groups, teachers, days_, timeslots_)
+    solution = backtrack({}, stats=stats, problem=problem)
+    cache.store(key, problem, solution)
+    return problem, solution, False
+
+
 def print_timetable(
-    solution: Optional[Dict[Variable, Tuple[str, int, Teacher]]]
+    solution: Optional[Dict[Variable, Tuple[str, int, Teacher]]],
+    problem: Problem = PROBLEM,
 ) -> None:
     if not solution:
         print("No solution found.")
         return
 
     timetable = {
-        group.name: {day: {ts: None for ts in timeslots} for day in days}
-        for group in GROUPS
+        group.name: {
+            day: {ts: None for ts in problem.timeslots} for day in problem.days
+        }
+        for group in problem.groups
     }
     for var, (day, timeslot, teacher) in solution.items():
         timetable[var.group.name][day][timeslot] = (var.subject.name, teacher.name)
@@ -382,7 +1997,36 @@ def main() -> Optional[Dict[Variable, Tuple[str, int, Teacher]]]:
             return None  # or handle accordingly
 
     # Solve the CSP
-    result = backtrack({})
+    if SOLVER == "portfolio":
+        winner = portfolio_solve()
+        if winner is None:
+            result = None
+        else:
+            strategy, result = winner
+            print(f"Portfolio winner: {strategy}")
+    elif SOLVER == "decomposed":
+        print(f"Independent parts: {len(connected_components())}")
+        result = decomposed_solve()
+    elif SOLVER == "min_conflicts":
+        result = min_conflicts()
+    elif SOLVER == "optimize":
+        best = best_within(OPTIMIZE_SECONDS)
+        if best is None:
+            result = None
+        else:
+            best_cost, result = best
+            print(f"Soft cost: {best_cost}")
+    elif SOLVER == "backjumping":
+        result, stats = backjump_search()
+        print(stats)
+    elif CACHE_DIR is not None:
+        stats = SearchStats()
+        _, result, cached = cached_solve(stats=stats)
+        print("Solution loaded from the cache" if cached else stats)
+    else:
+        stats = SearchStats()
+        result = backtrack({}, stats=stats)
+        print(stats)
     if result is None:
         print("No solution found")
         return None
@@ -392,5 +2036,6 @@ def main() -> Optional[Dict[Variable, Tuple[str, int, Teacher]]]:
     return result
 
 
-solution = main()
-print(solution)
+if __name__ == "__main__":
+    solution = main()
+    print(solution)